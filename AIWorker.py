@@ -0,0 +1,203 @@
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from Rules import update_board
+
+"""
+Long-lived process running the searches of one AI player. The player object
+lives in the worker for the whole game, so its transposition table, history
+table and evaluators are kept from one move to the next, and a move costs a
+queue round trip instead of starting a new process.
+
+The worker sends the best move so far after every search iteration, so when
+the time limit of a move runs out the search is cancelled and that move is
+played instead of the move being lost.
+
+Between its moves the worker can ponder: search on the opponent's time,
+until the next move is asked for, the position after the reply its last
+search predicted, or the opponent's position if there is no prediction.
+Whatever the reply, the next search starts with the tables filled.
+"""
+
+
+class _Cancelled:
+    """cancel_event of the player in the worker: set once the parent gives up on request_id"""
+
+    def __init__(self, cancelled_id, request_id):
+        self.cancelled_id = cancelled_id
+        self.request_id = request_id
+
+    def is_set(self):
+        return self.cancelled_id.value >= self.request_id
+
+
+def predicted_reply(player, searched, board):
+    """
+    Opponent move expected on board from the principal variation of the last
+    search, on searched; None unless board is searched plus the move it chose
+    """
+    progress = player.best_so_far
+    if searched is None or progress is None or len(progress['pv']) < 2:
+        return None
+    expected = searched.copy()
+    try:
+        update_board(expected, progress['pv'][0], player.player_number)
+        reply_board = expected.copy()
+        update_board(reply_board, progress['pv'][1], 3 - player.player_number)
+    except Exception:
+        return None
+    if not np.array_equal(expected, board):
+        return None
+    return progress['pv'][1]
+
+
+def _ponder(player, method, board, predicted):
+    """Search until cancelled on the opponent's time, return what was searched"""
+    start = time.time()
+    if predicted is not None:
+        board = board.copy()
+        update_board(board, predicted, 3 - player.player_number)
+    time_limit, player.time_limit = player.time_limit, None
+    try:
+        getattr(player, method)(board)
+    finally:
+        player.time_limit = time_limit
+    return {'predicted': predicted, 'depth': player.depth_reached, 'nodes': player.nodes,
+            'seconds': time.time() - start}
+
+
+def _serve(player, requests, replies, cancelled_id):
+    searched = None  # board of the last move searched
+    while True:
+        request = requests.get()
+        if request is None:
+            player.close()
+            break
+        request_id, method, board, ponder = request
+        player.cancel_event = _Cancelled(cancelled_id, request_id)
+        if ponder:
+            player.on_progress = None
+            predicted = predicted_reply(player, searched, board)
+            searched = None
+            try:
+                replies.put(('ponder', request_id, _ponder(player, method, board, predicted)))
+            except Exception as e:
+                replies.put(('ponder', request_id, {'error': '{}: {}'.format(type(e).__name__, e)}))
+            continue
+        player.on_progress = lambda progress: replies.put(('progress', request_id, progress))
+        start = time.time()
+        searched = board
+        try:
+            move, stats = getattr(player, method)(board, return_stats=True)
+            stats, error = stats.as_dict(), None
+        except Exception as e:
+            move, stats, error = None, None, '{}: {}'.format(type(e).__name__, e)
+        replies.put(('move', request_id, move, time.time() - start, stats, error))
+
+
+class AIWorker:
+    def __init__(self, player):
+        self.player_number = player.player_number
+        self.requests = mp.Queue()
+        self.replies = mp.Queue()
+        self.cancelled_id = mp.Value('i', 0)  # searches up to this request id are cancelled
+        # not a daemon: the player may start its own pool (workers > 1)
+        self.process = mp.Process(target=_serve, args=(player, self.requests, self.replies,
+                                                       self.cancelled_id))
+        self.process.start()
+        self.request_id = 0
+        self.overheads = []  # seconds of every move spent outside the search
+        self.stats = []  # SearchStats.as_dict() of every move the search finished
+        self.best_so_far = None  # last progress report of the current move
+        self.timed_out = False  # the last move was the best so far when time ran out
+        self.pondering = None  # request id of the ponder search running, if any
+        self.ponder_board = None
+        self.ponder_stats = []  # what every ponder search did, and whether it predicted the reply
+
+    def get_move(self, board, method, time_limit=None):
+        """
+        Ask the worker for player.method(board). The search stops itself at
+        its own deadline; time_limit is a hard limit after which the search
+        is cancelled and the best move so far returned, with timed_out set.
+        Raises an Exception if there is no move by then.
+        """
+        self.stop_pondering()
+        self.request_id += 1
+        self.best_so_far = None
+        self.timed_out = False
+        sent = time.time()
+        self.requests.put((self.request_id, method, board, False))
+        while True:
+            remaining = None if time_limit is None else sent + time_limit - time.time()
+            if remaining is not None and remaining <= 0:
+                return self.give_up()
+            try:
+                reply = self.replies.get(timeout=remaining)
+            except queue.Empty:
+                return self.give_up()
+            if reply[0] == 'ponder':
+                self.pondered(reply[2], board)
+                continue
+            if reply[1] != self.request_id:
+                continue  # older replies belong to moves that timed out
+            if reply[0] == 'progress':
+                self.best_so_far = reply[2]
+                continue
+            break
+        kind, request_id, move, search_time, stats, error = reply
+        if error is not None:
+            raise Exception(error)
+        self.overheads.append(time.time() - sent - search_time)
+        self.stats.append(stats)
+        return move
+
+    def ponder(self, board, method):
+        """
+        Search on the opponent's time from board, the position after this
+        player's move, until the next get_move
+        """
+        self.stop_pondering()
+        self.request_id += 1
+        self.pondering = self.request_id
+        self.ponder_board = board.copy()
+        self.requests.put((self.request_id, method, self.ponder_board, True))
+
+    def stop_pondering(self):
+        if self.pondering is not None:
+            self.cancelled_id.value = self.pondering
+            self.pondering = None
+
+    def pondered(self, stats, board):
+        """Keep the report of a ponder search, board being the position it was for"""
+        if stats.get('predicted') is not None and self.ponder_board is not None:
+            # the reply is the one disc more on board than after this player's move
+            changed = np.argwhere(board != self.ponder_board)
+            stats['hit'] = len(changed) == 1 and int(changed[0][1]) == stats['predicted']
+        self.ponder_stats.append(stats)
+
+    def give_up(self):
+        """Cancel the search of the current move and return its best move so far"""
+        self.cancelled_id.value = self.request_id
+        if self.best_so_far is None:
+            raise Exception('Player Exceeded time limit')
+        self.timed_out = True
+        return self.best_so_far['move']
+
+    def overhead_stats(self):
+        """Mean and max seconds per move spent outside the search"""
+        if not self.overheads:
+            return {'moves': 0, 'mean': 0.0, 'max': 0.0}
+        return {'moves': len(self.overheads),
+                'mean': sum(self.overheads) / len(self.overheads),
+                'max': max(self.overheads)}
+
+    def close(self):
+        self.stop_pondering()
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
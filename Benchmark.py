@@ -0,0 +1,294 @@
+# system libs
+import argparse
+import json
+import sys
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import Bitboard
+from Player import AIPlayer
+from Rules import available_actions, game_completed
+from Solver import Solver
+
+"""
+Benchmark of the AI on a fixed corpus of positions. Every run times
+evaluation_function, game_completed, available_actions and
+get_alpha_beta_move on each position, reports latency percentiles and nodes
+per second, checks the moves played on solved positions, and compares the
+numbers with a stored baseline to flag regressions:
+
+    python Benchmark.py                      # compare with benchmark_baseline.json
+    python Benchmark.py --save-baseline      # store this run as the new baseline
+    python Benchmark.py --write-corpus       # regenerate benchmark_positions.json
+
+Only the numbers that do not depend on the machine are compared by default:
+the nodes searched at the fixed depth and the best moves on the solved
+positions, and only those are stored in the committed baseline. Timings are
+compared with --timing, against a baseline stored on the same machine:
+
+    python Benchmark.py --timing --save-baseline --baseline local_baseline.json
+    python Benchmark.py --timing --baseline local_baseline.json
+
+Positions are written as the columns played from the empty board, 1 based
+('4453' is column 4, 4, 5 then 3), the usual notation of Connect 4 test sets.
+Endgame positions carry their exact solver score for the player to move.
+"""
+
+CORPUS_PATH = 'benchmark_positions.json'
+BASELINE_PATH = 'benchmark_baseline.json'
+
+# (stage, discs on the board) of the generated positions
+STAGES = [('early', (4, 8)), ('mid', (14, 20)), ('endgame', (24, 30))]
+DEFAULT_DEPTH = 8  # fixed search depth so node counts are reproducible
+DEFAULT_REPEAT = 200  # calls per position for the micro benchmarks
+DEFAULT_TOLERANCE = 0.25  # relative slowdown flagged as a regression
+
+
+def position_board(moves, rows=6, cols=7):
+    """Numpy board after playing the 1 based column string moves"""
+    state = Bitboard(rows, cols)
+    for c in moves:
+        state.play(int(c) - 1, state.to_move())
+    return state.to_array()
+
+
+def make_corpus(per_stage=10, seed=0, rows=6, cols=7):
+    """
+    Random positions of every stage where the game is still going and the
+    player to move cannot win at once; endgame positions are solved
+    """
+    rng = np.random.RandomState(seed)
+    solver = Solver(rows, cols)
+    corpus = []
+    for stage, (low, high) in STAGES:
+        found = 0
+        while found < per_stage:
+            target = rng.randint(low, high + 1)
+            state = Bitboard(rows, cols)
+            moves = ''
+            while state.move_count < target:
+                col = int(rng.choice(state.available_actions()))
+                state.play(col, state.to_move())
+                moves += str(col + 1)
+                if state.has_won(state.last_player()):
+                    break
+            if state.move_count < target or state.has_won(state.last_player()):
+                continue
+            current, mask, n = solver.position(state)
+            if solver.can_win_next(current, mask):
+                continue
+            position = {'moves': moves, 'stage': stage, 'score': None}
+            if stage == 'endgame':
+                position['score'] = solver.solve(current, mask, n)
+            corpus.append(position)
+            found += 1
+    return corpus
+
+
+def latency_stats(seconds):
+    """Percentiles of a list of durations, in microseconds"""
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+    return {'p50_us': 1e6 * p50, 'p90_us': 1e6 * p90, 'p99_us': 1e6 * p99,
+            'max_us': 1e6 * max(seconds), 'calls': len(seconds)}
+
+
+def time_calls(func, boards, repeat, rounds=5):
+    """
+    Latency of func(board) over every board: the best of rounds runs of
+    repeat calls in a row, like timeit, so other load on the machine
+    counts as little as possible
+    """
+    seconds = []
+    for board in boards:
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func(board)
+            best = min(best, (time.perf_counter() - start) / repeat)
+        seconds.append(best)
+    return latency_stats(seconds)
+
+
+def move_keeps_score(solver, board, move, score):
+    """True if playing move on a position solved to score keeps that score"""
+    state = Bitboard.from_array(board)
+    state.play(move, state.to_move())
+    if state.has_won(state.last_player()):
+        return True
+    current, mask, n = solver.position(state)
+    return -solver.solve(current, mask, n) == score
+
+
+def run_benchmark(corpus, depth=DEFAULT_DEPTH, repeat=DEFAULT_REPEAT, search='alphabeta',
+                  aspiration=None):
+    """
+    Time the AI on every corpus position and return the report as a dict;
+    search and aspiration are passed on to AIPlayer
+    """
+    boards = [position_board(p['moves']) for p in corpus]
+    evaluator = AIPlayer(1, time_limit=None)
+    report = {
+        'depth': depth,
+        'search': search,
+        'aspiration': aspiration,
+        'positions': len(corpus),
+        'evaluation_function': time_calls(evaluator.evaluation_function, boards, repeat),
+        'game_completed': time_calls(lambda b: game_completed(b, 1) or game_completed(b, 2),
+                                     boards, repeat),
+        'available_actions': time_calls(available_actions, boards, repeat),
+    }
+
+    solver = Solver()
+    stages = {}
+    move_seconds = []
+    total_nodes = 0
+    for position, board in zip(corpus, boards):
+        # a new player every time so no table carries over between positions
+        player_num = 1 if len(position['moves']) % 2 == 0 else 2
+        ai = AIPlayer(player_num, time_limit=None, max_depth=depth, search=search,
+                      aspiration=aspiration)
+        start = time.perf_counter()
+        move, stats = ai.get_alpha_beta_move(board, return_stats=True)
+        seconds = time.perf_counter() - start
+        move_seconds.append(seconds)
+        total_nodes += stats.nodes
+        stage = stages.setdefault(position['stage'], {'positions': 0, 'nodes': 0, 'seconds': 0.0,
+                                                      'solved': 0, 'best_moves': 0})
+        stage['positions'] += 1
+        stage['nodes'] += stats.nodes
+        stage['seconds'] += seconds
+        if position['score'] is not None:
+            stage['solved'] += 1
+            stage['best_moves'] += int(move_keeps_score(solver, board, move, position['score']))
+    for stage in stages.values():
+        stage['nodes_per_second'] = stage['nodes'] / stage['seconds'] if stage['seconds'] else 0.0
+
+    report['get_alpha_beta_move'] = latency_stats(move_seconds)
+    report['get_alpha_beta_move']['nodes'] = total_nodes
+    report['get_alpha_beta_move']['nodes_per_second'] = total_nodes / sum(move_seconds)
+    report['stages'] = stages
+    report['end_to_end_seconds'] = sum(move_seconds)
+    return report
+
+
+def baseline_report(report, timing=False):
+    """report as stored for a baseline, without the timings unless timing is set"""
+    if timing:
+        return report
+    return {
+        'depth': report['depth'],
+        'search': report['search'],
+        'aspiration': report['aspiration'],
+        'positions': report['positions'],
+        'get_alpha_beta_move': {'nodes': report['get_alpha_beta_move']['nodes']},
+        'stages': {name: {key: stage[key] for key in ['positions', 'nodes', 'solved', 'best_moves']}
+                   for name, stage in report['stages'].items()},
+    }
+
+
+def has_timings(baseline):
+    return 'p50_us' in baseline.get('get_alpha_beta_move', {})
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE, timing=False):
+    """
+    Regressions of report against baseline: more nodes searched with the
+    same search settings or fewer best moves on the solved positions, and
+    with timing median latencies more than tolerance slower or nodes per
+    second more than tolerance lower
+    """
+    regressions = []
+
+    def check(name, value, base, higher_is_worse=True):
+        if base is None or value is None or base == 0:
+            return
+        change = (value - base) / base
+        if (change if higher_is_worse else -change) > tolerance:
+            regressions.append({'metric': name, 'baseline': base, 'value': value,
+                                'change': change})
+
+    if timing:
+        for func in ['evaluation_function', 'game_completed', 'available_actions',
+                     'get_alpha_beta_move']:
+            # medians only, the tails of microsecond timings are mostly noise
+            check('{}.p50_us'.format(func), report[func]['p50_us'],
+                  baseline.get(func, {}).get('p50_us'))
+        check('get_alpha_beta_move.nodes_per_second',
+              report['get_alpha_beta_move']['nodes_per_second'],
+              baseline.get('get_alpha_beta_move', {}).get('nodes_per_second'),
+              higher_is_worse=False)
+    same_search = all(report[key] == baseline.get(key)
+                      for key in ['depth', 'search', 'aspiration'])
+    if same_search:
+        # node counts are deterministic at a fixed depth, any growth is a change in the search
+        check('get_alpha_beta_move.nodes', report['get_alpha_beta_move']['nodes'],
+              baseline['get_alpha_beta_move']['nodes'])
+    for name, stage in report['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if base is not None and stage['best_moves'] < base['best_moves']:
+            regressions.append({'metric': 'stages.{}.best_moves'.format(name),
+                                'baseline': base['best_moves'], 'value': stage['best_moves'],
+                                'change': stage['best_moves'] - base['best_moves']})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=CORPUS_PATH,
+                        help='Position corpus (JSON)')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='Stored results to compare with (JSON)')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help='Search depth of get_alpha_beta_move (int)')
+    parser.add_argument('--search', choices=['alphabeta', 'pvs'], default='alphabeta',
+                        help='Search mode of the AI')
+    parser.add_argument('--aspiration', type=int, default=None,
+                        help='Aspiration window half width of the AI (int)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Calls per position for the micro benchmarks (int)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative slowdown reported as a regression')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store this run as the baseline instead of comparing')
+    parser.add_argument('--timing', action='store_true',
+                        help='Compare (or store) the timings too, for a baseline of this machine')
+    parser.add_argument('--write-corpus', action='store_true',
+                        help='Generate a new corpus before running')
+    parser.add_argument('--output', default=None,
+                        help='File to write the JSON report to instead of stdout')
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        with open(args.corpus, 'w') as f:
+            json.dump(make_corpus(), f, indent=1)
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+
+    report = run_benchmark(corpus, args.depth, args.repeat, args.search, args.aspiration)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline_report(report, args.timing), f, indent=2)
+    else:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = None  # nothing to compare with yet
+        if args.timing and baseline is not None and not has_timings(baseline):
+            sys.exit('{} holds no timings, store a baseline of this machine with '
+                     '--timing --save-baseline'.format(args.baseline))
+        report['regressions'] = None if baseline is None else compare(
+            report, baseline, args.tolerance, args.timing)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if report.get('regressions'):
+        sys.exit(1)
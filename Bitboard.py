@@ -0,0 +1,342 @@
+import random
+
+import numpy as np
+
+"""
+Compact Connect 4 position used as the internal state of the AI search.
+
+Each column is stored as rows + 1 bits (the extra bit is a sentinel that keeps
+columns from bleeding into each other when shifting), bit 0 of a column being
+the bottom cell. One mask is kept per player plus the height of every column,
+so playing and taking back a move are O(1).
+
+    6 13 20 27 34 41 48
+    5 12 19 26 33 40 47      <- row 0 of the numpy board
+    4 11 18 25 32 39 46
+    3 10 17 24 31 38 45
+    2  9 16 23 30 37 44
+    1  8 15 22 29 36 43
+    0  7 14 21 28 35 42      <- last row of the numpy board
+
+Any board size and line length work: masks are Python ints, and the numpy
+helpers switch to object arrays when a layout needs more than 64 bits.
+"""
+
+CONNECT = 4  # discs in a line needed to win
+
+
+_bit_weights = {}
+
+
+def mask_dtype(rows, cols):
+    """numpy dtype that holds a disc mask of the layout"""
+    return np.uint64 if (rows + 1) * cols <= 64 else object
+
+
+def bit_weights(rows, cols):
+    """Value of every cell of a rows x cols numpy board in the bitboard layout"""
+    if (rows, cols) not in _bit_weights:
+        weights = np.zeros([rows, cols], dtype=mask_dtype(rows, cols))
+        for row in range(rows):
+            for col in range(cols):
+                weights[row, col] = 1 << (col * (rows + 1) + (rows - 1 - row))
+        _bit_weights[(rows, cols)] = weights
+    return _bit_weights[(rows, cols)]
+
+
+def player_mask(board, player_num):
+    """Bitboard mask of player_num's discs on a numpy board"""
+    weights = bit_weights(*board.shape)
+    return int(weights[board == player_num].sum())
+
+
+_zobrist_keys = {}
+
+
+def zobrist_keys(rows, cols, seed=2019):
+    """Random 64-bit key for every (player, bit index) pair of the layout"""
+    if (rows, cols) not in _zobrist_keys:
+        rng = random.Random(seed)
+        n_bits = cols * (rows + 1)
+        _zobrist_keys[(rows, cols)] = [[rng.getrandbits(64) for _ in range(n_bits)]
+                                       for _ in range(2)]
+    return _zobrist_keys[(rows, cols)]
+
+
+def winning_cells(m, col_bits, connect=CONNECT):
+    """
+    Cells that would give the disc mask m connect in a row, empty or not and
+    including cells outside the board; mask the result with the empty
+    playable cells
+    """
+    if connect != 4:
+        # the new disc can be at any position j of the line
+        r = 0
+        for shift in (1, col_bits, col_bits - 1, col_bits + 1):
+            # vertically there is nothing above the new disc
+            for j in range(connect - 1, connect) if shift == 1 else range(connect):
+                line = -1
+                for k in range(-j, connect - j):
+                    if k > 0:
+                        line &= m >> (k * shift)
+                    elif k < 0:
+                        line &= m << (-k * shift)
+                r |= line
+        return r
+    # vertical: only three discs right below
+    r = (m << 1) & (m << 2) & (m << 3)
+    # horizontal and the two diagonals: any of the four positions in a line
+    for shift in (col_bits, col_bits - 1, col_bits + 1):
+        p = (m << shift) & (m << 2 * shift)
+        r |= p & (m << 3 * shift)
+        r |= p & (m >> shift)
+        p = (m >> shift) & (m >> 2 * shift)
+        r |= p & (m << shift)
+        r |= p & (m >> 3 * shift)
+    return r
+
+
+def mask_has_won(m, col_bits, connect=CONNECT):
+    """Shift-and-mask check for connect in a row in the disc mask m"""
+    # vertical, horizontal, and the two diagonals
+    for shift in (1, col_bits, col_bits - 1, col_bits + 1):
+        # runs of length doubling each step, then one overlapping step for the rest
+        runs, length = m, 1
+        while 2 * length <= connect:
+            runs &= runs >> (length * shift)
+            length *= 2
+        if length < connect:
+            runs &= runs >> ((connect - length) * shift)
+        if runs:
+            return True
+    return False
+
+
+class Bitboard:
+    def __init__(self, rows=6, cols=7, connect=CONNECT):
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.col_bits = rows + 1
+        self.bottom = sum(1 << (col * self.col_bits) for col in range(cols))
+        self.board_mask = self.bottom * ((1 << rows) - 1)  # every cell, no sentinel bits
+        self.masks = [0, 0]  # discs of player 1 and player 2
+        self.heights = [0 for _ in range(cols)]  # discs in each column
+        self.history = []  # played (column, player_num) pairs, for undo
+        self.keys = zobrist_keys(rows, cols)
+        self.hash = 0  # Zobrist hash, updated incrementally by play/undo
+        self.mirror_hash = 0  # Zobrist hash of the left-right mirror image
+        self.tracker = None  # optional incremental evaluation, see attach
+
+    @classmethod
+    def from_array(cls, board, connect=CONNECT):
+        """
+        Build a bitboard from the numpy board encoding used by the game
+        (row 0 is the top, 0 is empty, 1/2 are the players' discs)
+        """
+        rows, cols = board.shape
+        state = cls(rows, cols, connect)
+        state.masks = [player_mask(board, 1), player_mask(board, 2)]
+        state.heights = [int(h) for h in (board != 0).sum(axis=0)]
+        state.init_hashes()
+        return state
+
+    @classmethod
+    def from_masks(cls, rows, cols, p1_mask, p2_mask, connect=CONNECT):
+        """Build a bitboard from the two disc masks"""
+        state = cls(rows, cols, connect)
+        state.masks = [p1_mask, p2_mask]
+        occupied = p1_mask | p2_mask
+        for col in range(cols):
+            while occupied >> (col * state.col_bits + state.heights[col]) & 1:
+                state.heights[col] += 1
+        state.init_hashes()
+        return state
+
+    def init_hashes(self):
+        """Compute hash and mirror_hash from scratch from the disc masks"""
+        self.hash = 0
+        self.mirror_hash = 0
+        for player in range(2):
+            m = self.masks[player]
+            while m:
+                low = m & -m
+                index = low.bit_length() - 1
+                self.hash ^= self.keys[player][index]
+                self.mirror_hash ^= self.keys[player][self.mirror_index(index)]
+                m ^= low
+
+    def to_array(self):
+        """Convert back to the numpy board encoding used by the game"""
+        board = np.zeros([self.rows, self.cols]).astype(np.uint8)
+        for col in range(self.cols):
+            for h in range(self.heights[col]):
+                bit = 1 << (col * self.col_bits + h)
+                board[self.rows - 1 - h, col] = 1 if self.masks[0] & bit else 2
+        return board
+
+    def copy(self):
+        state = Bitboard(self.rows, self.cols, self.connect)
+        state.masks = list(self.masks)
+        state.heights = list(self.heights)
+        state.history = list(self.history)
+        state.hash = self.hash
+        state.mirror_hash = self.mirror_hash
+        return state
+
+    def attach(self, tracker):
+        """
+        Keep tracker up to date on every play/undo; tracker needs
+        play(index, player_num) and undo(index, player_num) methods
+        """
+        self.tracker = tracker
+        return tracker
+
+    def mirror_index(self, index):
+        """Bit index of the cell mirroring bit index across the middle column"""
+        col, height = divmod(index, self.col_bits)
+        return (self.cols - 1 - col) * self.col_bits + height
+
+    def mirror_col(self, col):
+        return self.cols - 1 - col
+
+    def bit(self, row, col):
+        """Bit index of the cell at numpy board coordinates (row, col)"""
+        return col * self.col_bits + (self.rows - 1 - row)
+
+    @property
+    def move_count(self):
+        return sum(self.heights)
+
+    def to_move(self):
+        """Number of the player whose turn it is (player 1 always starts)"""
+        return 1 if self.move_count % 2 == 0 else 2
+
+    def can_play(self, col):
+        return self.heights[col] < self.rows
+
+    def available_actions(self):
+        """Valid columns, left to right"""
+        return [col for col in range(self.cols) if self.heights[col] < self.rows]
+
+    def is_full(self):
+        return self.move_count == self.rows * self.cols
+
+    def play(self, col, player_num):
+        """Drop a disc of player_num in col"""
+        if self.heights[col] >= self.rows:
+            err = 'Invalid move by player {}. Column {}'.format(player_num, col)
+            raise Exception(err)
+        index = col * self.col_bits + self.heights[col]
+        self.masks[player_num - 1] |= 1 << index
+        self.hash ^= self.keys[player_num - 1][index]
+        self.mirror_hash ^= self.keys[player_num - 1][
+            (self.cols - 1 - col) * self.col_bits + self.heights[col]]
+        self.heights[col] += 1
+        self.history.append((col, player_num))
+        if self.tracker is not None:
+            self.tracker.play(index, player_num)
+
+    def undo(self):
+        """Take back the last move played"""
+        col, player_num = self.history.pop()
+        self.heights[col] -= 1
+        index = col * self.col_bits + self.heights[col]
+        self.masks[player_num - 1] ^= 1 << index
+        self.hash ^= self.keys[player_num - 1][index]
+        self.mirror_hash ^= self.keys[player_num - 1][
+            (self.cols - 1 - col) * self.col_bits + self.heights[col]]
+        if self.tracker is not None:
+            self.tracker.undo(index, player_num)
+
+    def bottom_mask(self):
+        """Mask with the bottom cell of every column set"""
+        return self.bottom
+
+    def playable_cells(self):
+        """Cells where a disc can be dropped, one per column that is not full"""
+        return ((self.masks[0] | self.masks[1]) + self.bottom) & self.board_mask
+
+    def winning_cells(self, player_num):
+        """Empty cells where a disc of player_num would complete a line"""
+        empty = self.board_mask ^ (self.masks[0] | self.masks[1])
+        return winning_cells(self.masks[player_num - 1], self.col_bits, self.connect) & empty
+
+    def threat_moves(self, player_num):
+        """
+        Threat analysis for player_num to move: (winning column or None,
+        columns that do not lose at once). With a threat of the opponent to
+        block only the blocking column is left, with two none is; a column
+        is never played right below a cell where the opponent would win.
+        """
+        possible = self.playable_cells()
+        wins = self.winning_cells(player_num) & possible
+        if wins:
+            return ((wins & -wins).bit_length() - 1) // self.col_bits, []
+        opponent_wins = self.winning_cells(3 - player_num)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return None, []  # two threats to block at once
+            possible = forced
+        possible &= ~(opponent_wins >> 1)
+        moves = []
+        while possible:
+            low = possible & -possible
+            moves.append((low.bit_length() - 1) // self.col_bits)
+            possible ^= low
+        return None, moves
+
+    def key(self):
+        """
+        Unique integer for the position: player 1's discs plus one bit just
+        above the top disc of every column
+        """
+        occupied = self.masks[0] | self.masks[1]
+        return self.masks[0] + occupied + self.bottom_mask()
+
+    def mirror(self, m):
+        """m (a disc mask or key) with the columns in reverse order"""
+        column = (1 << self.col_bits) - 1
+        mirrored = 0
+        for col in range(self.cols):
+            bits = (m >> (col * self.col_bits)) & column
+            mirrored |= bits << ((self.cols - 1 - col) * self.col_bits)
+        return mirrored
+
+    def canonical_key(self):
+        """
+        Smallest of the keys of the position and of its left-right mirror
+        image, and whether that is the mirror image
+        """
+        key = self.key()
+        mirrored = self.mirror(key)
+        if mirrored < key:
+            return mirrored, True
+        return key, False
+
+    def canonical_hash(self):
+        """
+        Smallest of the Zobrist hashes of the position and of its mirror
+        image, and whether that is the mirror image's
+        """
+        if self.mirror_hash < self.hash:
+            return self.mirror_hash, True
+        return self.hash, False
+
+    def is_symmetric(self):
+        """True if the position is its own left-right mirror image"""
+        key = self.key()
+        return self.mirror(key) == key
+
+    def has_won(self, player_num):
+        """Shift-and-mask check for a line of player_num"""
+        return mask_has_won(self.masks[player_num - 1], self.col_bits, self.connect)
+
+    def last_player(self):
+        """Number of the player who made the last move, None on an empty board"""
+        if self.history:
+            return self.history[-1][1]
+        if self.move_count == 0:
+            return None
+        return 2 if self.move_count % 2 == 0 else 1
@@ -0,0 +1,151 @@
+# system libs
+import argparse
+import sys
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import Bitboard
+from Player import WIN_SCORE, terminal_state
+from Rules import drop_row, game_completed, line_completed, update_board
+
+"""
+Cross-check of the win detection against a brute force scan that walks
+every line of connect cells of the numpy board. Random games are played on
+every board in CASES and after each move the mask test of game_completed,
+the last disc test of line_completed, Bitboard.has_won and terminal_state
+have to agree with the scan. So do the threat masks while the game goes on:
+Bitboard.winning_cells against trying a disc on every empty cell, and
+Bitboard.threat_moves against playing every column and looking for an
+immediate win of the opponent.
+
+    python CheckBitboard.py
+    python CheckBitboard.py --games 500 --seed 3
+
+Exits with status 1 on the first mismatch.
+"""
+
+# (rows, cols, connect) of the checked boards
+CASES = [
+    (6, 7, 4),
+    (4, 4, 4),
+    (7, 9, 5),
+    (5, 5, 3),
+]
+
+
+_lines = {}
+
+
+def lines(rows, cols, connect):
+    """(row indices, col indices) arrays of every line of connect cells of the board"""
+    if (rows, cols, connect) not in _lines:
+        found = []
+        for row in range(rows):
+            for col in range(cols):
+                for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+                    cells = [(row + k * dr, col + k * dc) for k in range(connect)]
+                    if all(0 <= r < rows and 0 <= c < cols for r, c in cells):
+                        found.append(cells)
+        found = np.array(found, dtype=int).reshape(-1, connect, 2)
+        _lines[(rows, cols, connect)] = found[:, :, 0], found[:, :, 1]
+    return _lines[(rows, cols, connect)]
+
+
+def brute_force_won(board, player_num, connect):
+    line_rows, line_cols = lines(board.shape[0], board.shape[1], connect)
+    return bool((board[line_rows, line_cols] == player_num).all(axis=1).any())
+
+
+def brute_force_winning_cells(board, player_num, connect):
+    """Bitboard mask of the empty cells where a disc of player_num completes a line"""
+    rows, cols = board.shape
+    cells = 0
+    for row, col in zip(*np.nonzero(board == 0)):
+        board[row, col] = player_num
+        if brute_force_won(board, player_num, connect):
+            cells |= 1 << int(col * (rows + 1) + (rows - 1 - row))
+        board[row, col] = 0
+    return cells
+
+
+def brute_force_threat_moves(board, player_num, connect):
+    """(winning column or None, columns after which the opponent cannot win at once)"""
+    playable = [c for c in range(board.shape[1]) if board[0, c] == 0]
+    for col in playable:
+        child = update_board(board.copy(), col, player_num)
+        if brute_force_won(child, player_num, connect):
+            return col, []
+    safe = []
+    for col in playable:
+        child = update_board(board.copy(), col, player_num)
+        replies = [c for c in range(board.shape[1]) if child[0, c] == 0]
+        if not any(brute_force_won(update_board(child.copy(), c, 3 - player_num),
+                                   3 - player_num, connect) for c in replies):
+            safe.append(col)
+    return None, safe
+
+
+def check_case(rows, cols, connect, games, rng):
+    for _ in range(games):
+        board = np.zeros([rows, cols], dtype=np.uint8)
+        state = Bitboard(rows, cols, connect)
+        player_num = 1
+        while True:
+            moves = [c for c in range(cols) if board[0, c] == 0]
+            if not moves:
+                break
+            move = int(rng.choice(moves))
+            row = drop_row(board, move)
+            update_board(board, move, player_num)
+            state.play(move, player_num)
+            won = brute_force_won(board, player_num, connect)
+            utility = (WIN_SCORE if player_num == 1 else -WIN_SCORE) if won else None
+            # (value, expected) of every check
+            checks = {
+                'game_completed': (game_completed(board, player_num, connect), won),
+                'line_completed': (line_completed(board, row, move, connect), won),
+                'Bitboard.has_won': (state.has_won(player_num), won),
+                'game_completed of the opponent': (
+                    game_completed(board, 3 - player_num, connect), False),
+                'terminal_state': (terminal_state(board, connect), utility),
+                'terminal_state of the Bitboard': (terminal_state(state), utility),
+            }
+            for name, (value, expected) in checks.items():
+                if value != expected:
+                    print('{}x{} connect {}: {} is {} after player {} played {} on\n{}'.format(
+                        rows, cols, connect, name, value, player_num, move, board))
+                    return False
+            if won:
+                break
+            player_num = 3 - player_num
+            for num in (1, 2):
+                cells = brute_force_winning_cells(board, num, connect)
+                if state.winning_cells(num) != cells:
+                    print('{}x{} connect {}: winning cells of player {} are {:b}, not {:b}, '
+                          'on\n{}'.format(rows, cols, connect, num, state.winning_cells(num),
+                                          cells, board))
+                    return False
+            threats = brute_force_threat_moves(board, player_num, connect)
+            if state.threat_moves(player_num) != threats:
+                print('{}x{} connect {}: threat moves of player {} are {}, not {}, on\n{}'.format(
+                    rows, cols, connect, player_num, state.threat_moves(player_num), threats,
+                    board))
+                return False
+    print('{}x{} connect {}: {} games match'.format(rows, cols, connect, games))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=100,
+                        help='Random games per case (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random games (int)')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for case in CASES:
+        if not check_case(*case, args.games, rng):
+            sys.exit(1)
@@ -0,0 +1,98 @@
+# system libs
+import argparse
+import sys
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Player import EVAL_BOUND, WIN_SCORE, AIPlayer
+from Rules import available_actions, game_completed, update_board
+
+"""
+Cross-check of the expectimax search against an unpruned reference: plain
+recursive expectimax on numpy boards, the AI maximizing and the random
+player averaging over its moves, without the cache, move ordering, Star1
+or Star2 pruning. For random positions the fixed depth root value of
+get_expectimax_move has to match the reference, and its move has to be
+one of the best moves of the reference.
+
+    python CheckExpectimax.py
+    python CheckExpectimax.py --positions 50 --depth 5
+
+Exits with status 1 on the first mismatch.
+"""
+
+# AIPlayer options the search is checked with
+SETTINGS = [
+    {},
+    {'star2': True},
+    {'symmetry': False},
+]
+
+
+def reference_value(player, board, to_move, depth):
+    """Expectimax value of board from player's side, to_move playing next"""
+    sign = 1 if player.player_number == 1 else -1
+    for num in (1, 2):
+        if game_completed(board, num):
+            return WIN_SCORE if num == player.player_number else -WIN_SCORE
+    actions = available_actions(board)
+    if not actions:
+        return 0.0
+    if depth == 0:
+        return max(-EVAL_BOUND, min(EVAL_BOUND, sign * player.evaluation_function(board)))
+    values = [reference_value(player, update_board(board.copy(), a, to_move), 3 - to_move,
+                              depth - 1)
+              for a in actions]
+    if to_move == player.player_number:
+        return max(values)
+    return sum(values) / len(values)
+
+
+def random_board(discs, rng, rows=6, cols=7):
+    """A random board with discs on it where nobody has won"""
+    while True:
+        board = np.zeros([rows, cols], dtype=np.uint8)
+        for ply in range(discs):
+            update_board(board, int(rng.choice(available_actions(board))), ply % 2 + 1)
+        if not game_completed(board, 1) and not game_completed(board, 2):
+            return board
+
+
+def check_position(board, depth, settings):
+    player_num = 1 if (board != 0).sum() % 2 == 0 else 2
+    player = AIPlayer(player_num, time_limit=None, max_depth=depth, **settings)
+    move = player.get_expectimax_move(board)
+    value = (1 if player_num == 1 else -1) * player.root_value
+    # the reference evaluates with a player of its own so nothing is shared
+    reference = AIPlayer(player_num, time_limit=None)
+    move_values = {a: reference_value(reference, update_board(board.copy(), a, player_num),
+                                      3 - player_num, depth - 1)
+                   for a in available_actions(board)}
+    best = max(move_values.values())
+    if abs(value - best) > 1e-6 or abs(move_values[move] - best) > 1e-6:
+        print('{}: searched value {} and move {}, reference value {} and move values {} '
+              'on\n{}'.format(settings, value, move, best, move_values, board))
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--positions', type=int, default=10,
+                        help='Random positions per setting and disc count (int)')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Search depth (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random positions (int)')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for settings in SETTINGS:
+        for discs in (4, 13, 26):
+            for _ in range(args.positions):
+                if not check_position(random_board(discs, rng), args.depth, settings):
+                    sys.exit(1)
+        print('{}: {} positions match at depth {}'.format(settings, 3 * args.positions,
+                                                           args.depth))
@@ -0,0 +1,94 @@
+# system libs
+import argparse
+import sys
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from AIWorker import AIWorker
+from Player import AIPlayer, RandomPlayer
+from Rules import available_actions, game_completed, update_board
+
+"""
+Check of the anytime search and of pondering, with a serial player and
+with a parallel one (workers > 1): a SearchHandle without a time limit has
+a best move so far while it runs and stops soon after it is cancelled, and
+an AIWorker pondering on the opponent's time plays every move of a game
+within its time limit, which it cannot when the ponder search does not stop.
+
+    python CheckPonder.py
+    python CheckPonder.py --workers 4 --time 0.5
+
+Exits with status 1 on the first failure.
+"""
+
+STOP_SECONDS = 0.2  # longest wait for a cancelled search
+
+
+def check_handle(workers, seconds):
+    player = AIPlayer(1, time_limit=None, workers=workers)
+    board = np.zeros([6, 7], dtype=np.uint8)
+    handle = player.start_search(board)
+    time.sleep(seconds)
+    progress = handle.poll()
+    start = time.time()
+    move = handle.stop(timeout=2)
+    stopped = time.time() - start
+    player.close()
+    if progress is None or not handle.done() or stopped > STOP_SECONDS:
+        print('workers {}: best so far {}, stopped after {:.3f}s, done {}'.format(
+            workers, progress, stopped, handle.done()))
+        return False
+    print('workers {}: search stopped after {:.3f}s at depth {}, move {}'.format(
+        workers, stopped, progress['depth'], move))
+    return True
+
+
+def check_ponder_game(workers, time_limit, seed):
+    worker = AIWorker(AIPlayer(1, time_limit=time_limit, workers=workers))
+    opponent = RandomPlayer(2, seed)
+    board = np.zeros([6, 7], dtype=np.uint8)
+    slowest = 0.0
+    try:
+        while available_actions(board):
+            start = time.time()
+            try:
+                move = worker.get_move(board, 'get_alpha_beta_move', time_limit)
+            except Exception as e:
+                print('workers {}: {} after {:.2f}s'.format(workers, e, time.time() - start))
+                return False
+            slowest = max(slowest, time.time() - start)
+            if worker.timed_out:
+                print('workers {}: a move was cut off at the time limit'.format(workers))
+                return False
+            update_board(board, move, 1)
+            if game_completed(board, 1) or not available_actions(board):
+                break
+            worker.ponder(board, 'get_alpha_beta_move')
+            time.sleep(time_limit / 2)  # the opponent thinking
+            update_board(board, opponent.get_move(board), 2)
+            if game_completed(board, 2):
+                break
+    finally:
+        worker.close()
+    print('workers {}: {} moves pondered, slowest move {:.2f}s of {}s'.format(
+        workers, len(worker.ponder_stats), slowest, time_limit))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3,
+                        help='Processes of the parallel player (int)')
+    parser.add_argument('--time', type=float, default=0.3,
+                        help='Time for a move in seconds')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random opponent (int)')
+    args = parser.parse_args()
+
+    for workers in (1, args.workers):
+        if not (check_handle(workers, 2 * args.time)
+                and check_ponder_game(workers, args.time, args.seed)):
+            sys.exit(1)
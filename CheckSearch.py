@@ -0,0 +1,116 @@
+# system libs
+import argparse
+import sys
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Player import WIN_SCORE, AIPlayer
+from Rules import available_actions, game_completed, update_board
+
+"""
+Cross-check of the alpha-beta search modes against plain minimax on numpy
+boards, without pruning, cache or move ordering. For random positions the
+fixed depth root value of get_alpha_beta_move has to match minimax in every
+mode of SETTINGS, and its move has to be one of the best moves.
+
+Threat analysis settles nodes one move ahead, which plain minimax does not
+do at the depth limit, so the modes are compared with minimax with it off,
+and with it on against plain alpha-beta with it on.
+
+    python CheckSearch.py
+    python CheckSearch.py --positions 50 --depth 5
+
+Exits with status 1 on the first mismatch.
+"""
+
+# search options checked, all with the solver off
+SETTINGS = [
+    {'search': 'alphabeta'},
+    {'search': 'pvs'},
+    {'search': 'alphabeta', 'aspiration': 50},
+    {'search': 'pvs', 'aspiration': 50},
+    {'search': 'pvs', 'symmetry': False},
+]
+
+
+def minimax_value(player, board, to_move, depth):
+    """Minimax value of board for player 1, to_move playing next"""
+    if game_completed(board, 1):
+        return WIN_SCORE
+    if game_completed(board, 2):
+        return -WIN_SCORE
+    actions = available_actions(board)
+    if not actions:
+        return 0
+    if depth == 0:
+        return player.evaluation_function(board)
+    values = [minimax_value(player, update_board(board.copy(), a, to_move), 3 - to_move,
+                            depth - 1)
+              for a in actions]
+    return max(values) if to_move == 1 else min(values)
+
+
+def random_board(discs, rng, rows=6, cols=7):
+    """A random board with discs on it where nobody has won"""
+    while True:
+        board = np.zeros([rows, cols], dtype=np.uint8)
+        for ply in range(discs):
+            update_board(board, int(rng.choice(available_actions(board))), ply % 2 + 1)
+        if not game_completed(board, 1) and not game_completed(board, 2):
+            return board
+
+
+def searched(board, depth, settings):
+    """(move, root value for player 1) of get_alpha_beta_move at a fixed depth"""
+    player_num = 1 if (board != 0).sum() % 2 == 0 else 2
+    player = AIPlayer(player_num, time_limit=None, max_depth=depth, solver_empties=None,
+                      **settings)
+    move = player.get_alpha_beta_move(board)
+    return move, player.root_value
+
+
+def check_position(board, depth):
+    player_num = 1 if (board != 0).sum() % 2 == 0 else 2
+    sign = 1 if player_num == 1 else -1
+    reference = AIPlayer(player_num, time_limit=None)
+    move_values = {a: sign * minimax_value(reference, update_board(board.copy(), a, player_num),
+                                           3 - player_num, depth - 1)
+                   for a in available_actions(board)}
+    best = max(move_values.values())
+    threats_value = None
+    for settings in SETTINGS:
+        move, value = searched(board, depth, dict(settings, threats=False))
+        if sign * value != best or move_values[move] != best:
+            print('{}: searched value {} and move {}, minimax value {} and move values {} '
+                  'for player {} on\n{}'.format(settings, sign * value, move, best, move_values,
+                                                player_num, board))
+            return False
+        move, value = searched(board, depth, settings)
+        if threats_value is None:
+            threats_value = value
+        elif value != threats_value:
+            print('{} with threats: searched value {}, plain alpha-beta {} on\n{}'.format(
+                settings, value, threats_value, board))
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--positions', type=int, default=10,
+                        help='Random positions per disc count (int)')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Search depth (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random positions (int)')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for discs in (3, 9, 16, 24):
+        for _ in range(args.positions):
+            if not check_position(random_board(discs, rng), args.depth):
+                sys.exit(1)
+        print('{} discs: {} positions match at depth {}'.format(discs, args.positions,
+                                                                 args.depth))
@@ -0,0 +1,131 @@
+# system libs
+import argparse
+import sys
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import Bitboard
+from Solver import Solver
+
+"""
+Cross-check of the exact solver against a brute force solve: plain minimax
+over the whole game tree of a position, without pruning, ordering or bound
+tricks, only memoized on the position. For random positions of every board
+in CASES the score of Solver.solve has to match the brute force one, the
+move of Solver.best_move has to keep it, and Solver.result has to give the
+outcome and the number of plies to the end of the game of the brute force.
+Boards with an odd number of cells are included: the score of a win depends
+on the parity of the moves there.
+
+    python CheckSolver.py
+    python CheckSolver.py --positions 50 --seed 3
+
+Exits with status 1 on the first mismatch.
+"""
+
+# (rows, cols, connect, discs on the board) of the checked positions
+CASES = [
+    (6, 7, 4, 30),
+    (6, 7, 4, 28),
+    (4, 5, 4, 8),
+    (5, 5, 4, 13),
+    (5, 7, 4, 23),
+    (7, 9, 4, 51),
+    (3, 5, 3, 3),
+]
+
+
+def brute_force(state, memo):
+    """
+    Outcome of the position for the player to move with perfect play, as
+    (1 win / 0 draw / -1 loss, discs on the board when the game ends);
+    winning sooner and losing later are better
+    """
+    key = tuple(state.masks)
+    if key in memo:
+        return memo[key]
+    best = None
+    for col in state.available_actions():
+        child = state.copy()
+        child.play(col, child.to_move())
+        if child.has_won(child.last_player()):
+            outcome = (1, child.move_count)
+        elif child.is_full():
+            outcome = (0, child.move_count)
+        else:
+            result, end = brute_force(child, memo)
+            outcome = (-result, end)
+        if best is None or rank(outcome) > rank(best):
+            best = outcome
+    memo[key] = best
+    return best
+
+
+def rank(outcome):
+    result, end = outcome
+    return result, -end if result > 0 else end
+
+
+def outcome_score(size, outcome):
+    """Solver score of an outcome: a win with the m-th disc of the game scores (size + 2 - m) // 2"""
+    result, end = outcome
+    return result * ((size + 2 - end) // 2) if result else 0
+
+
+def random_position(rows, cols, connect, discs, rng):
+    """A random position with discs on the board where the game is still going"""
+    while True:
+        state = Bitboard(rows, cols, connect)
+        while state.move_count < discs:
+            state.play(int(rng.choice(state.available_actions())), state.to_move())
+            if state.has_won(state.last_player()):
+                break
+        if state.move_count == discs and not state.has_won(state.last_player()):
+            return state
+
+
+def check_case(rows, cols, connect, discs, positions, rng):
+    solver = Solver(rows, cols, connect=connect)
+    memo = {}
+    for _ in range(positions):
+        state = random_position(rows, cols, connect, discs, rng)
+        current, mask, moves = solver.position(state)
+        outcome = brute_force(state, memo)
+        expected = outcome_score(solver.size, outcome)
+        expected_result = ({1: 'win', 0: 'draw', -1: 'loss'}[outcome[0]], outcome[1] - moves)
+        score = solver.solve(current, mask, moves)
+        move, best_score = solver.best_move(state)
+        child = state.copy()
+        child.play(move, child.to_move())
+        if child.has_won(child.last_player()):
+            kept = outcome_score(solver.size, (1, child.move_count))
+        elif child.is_full():
+            kept = 0
+        else:
+            kept = -outcome_score(solver.size, brute_force(child, memo))
+        result = solver.result(score, moves)
+        if (score != expected or best_score != expected or kept != expected
+                or result != expected_result):
+            print('{}x{} connect {}: position {} solved to {} {}, best move {} keeps {}, '
+                  'brute force {} {}'.format(rows, cols, connect, state.masks, score, result,
+                                             move, kept, expected, expected_result))
+            return False
+    print('{}x{} connect {}, {} discs: {} positions match'.format(
+        rows, cols, connect, discs, positions))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--positions', type=int, default=20,
+                        help='Random positions per case (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random positions (int)')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for case in CASES:
+        if not check_case(*case, args.positions, rng):
+            sys.exit(1)
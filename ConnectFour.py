@@ -1,46 +1,56 @@
 # system libs
 import argparse
-import multiprocessing as mp
 import tkinter as tk
 
 # 3rd party libs
 import numpy as np
 
 # Local libs
+from AIWorker import AIWorker
+from Bitboard import CONNECT
 from Player import AIPlayer, RandomPlayer, HumanPlayer
+from Rules import drop_row, is_full, line_completed
 
-#https://stackoverflow.com/a/37737985
-def turn_worker(board, send_end, p_func):
-    send_end.send(p_func(board))
+CELL_SIZE = 100  # pixels per board cell
 
 
 class Game:
-    def __init__(self, player1, player2, time):
+    def __init__(self, player1, player2, time, rows=6, cols=7, connect=CONNECT, ponder=False):
         self.players = [player1, player2]
         self.colors = ['yellow', 'red']
         self.current_turn = 0
-        self.board = np.zeros([6,7]).astype(np.uint8)
+        self.board = np.zeros([rows, cols]).astype(np.uint8)
+        self.connect = connect
         self.gui_board = []
         self.game_over = False
+        self.last_move = None  # (row, col) of the last disc dropped
         self.ai_turn_limit = time
+        # one long-lived search process per AI player, keeping its tables between moves
+        self.workers = [AIWorker(p) if p.type == 'ai' else None for p in self.players]
+        self.ponder = ponder  # AI players keep searching during the opponent's turn
 
         #https://stackoverflow.com/a/38159672
         root = tk.Tk()
-        root.title('Connect 4')
+        root.title('Connect {}'.format(connect))
         self.player_string = tk.Label(root, text=player1.player_string)
         self.player_string.pack()
-        self.c = tk.Canvas(root, width=700, height=600)
+        self.c = tk.Canvas(root, width=cols * CELL_SIZE, height=rows * CELL_SIZE)
         self.c.pack()
 
-        for row in range(0, 700, 100):
+        for x in range(0, cols * CELL_SIZE, CELL_SIZE):
             column = []
-            for col in range(0, 700, 100):
-                column.append(self.c.create_oval(row, col, row+100, col+100, fill=''))
+            for y in range(0, rows * CELL_SIZE, CELL_SIZE):
+                column.append(self.c.create_oval(x, y, x+CELL_SIZE, y+CELL_SIZE, fill=''))
             self.gui_board.append(column)
 
         tk.Button(root, text='Next Move', command=self.make_move).pack()
 
-        root.mainloop()
+        try:
+            root.mainloop()
+        finally:
+            for worker in self.workers:
+                if worker is not None:
+                    worker.close()
 
     def make_move(self):
         if not self.game_over:
@@ -49,24 +59,38 @@ class Game:
             if current_player.type == 'ai':
                 
                 if self.players[int(not self.current_turn)].type == 'random':
-                    p_func = current_player.get_expectimax_move
+                    p_func = 'get_expectimax_move'
                 else:
-                    p_func = current_player.get_alpha_beta_move
+                    p_func = 'get_alpha_beta_move'
                 
+                worker = self.workers[self.current_turn]
+                pondered = len(worker.ponder_stats)
                 try:
-                    recv_end, send_end = mp.Pipe(False)
-                    p = mp.Process(target=turn_worker, args=(self.board, send_end, p_func))
-                    p.start()
-                    if p.join(self.ai_turn_limit) is None and p.is_alive():
-                        p.terminate()
-                        raise Exception('Player Exceeded time limit')
+                    move = worker.get_move(self.board, p_func, self.ai_turn_limit)
                 except Exception as e:
                     uh_oh = 'Uh oh.... something is wrong with Player {}'
                     print(uh_oh.format(current_player.player_number))
                     print(e)
                     raise Exception('Game Over')
 
-                move = recv_end.recv()
+                if worker.timed_out:
+                    best = worker.best_so_far
+                    late = 'Player {} out of time, playing the best move so far (depth {})'
+                    print(late.format(current_player.player_number, best['depth']))
+                else:
+                    overhead = 'Player {} worker overhead: {:.1f} ms'
+                    print(overhead.format(current_player.player_number,
+                                          1000 * worker.overheads[-1]))
+                    stats = worker.stats[-1]
+                    search = '  {} nodes, depth {}, {:.0f} nodes/s, TT hit rate {:.2f} ({})'
+                    print(search.format(stats['nodes'], stats['depth_reached'],
+                                        stats['nodes_per_second'], stats['tt_hit_rate'],
+                                        stats['source']))
+                if len(worker.ponder_stats) > pondered:
+                    ponder = worker.ponder_stats[-1]
+                    guess = 'reply predicted' if ponder.get('hit') else 'reply not predicted'
+                    print('  pondered to depth {} for {:.1f} s, {}'.format(
+                        ponder.get('depth'), ponder.get('seconds', 0.0), guess))
             else:
                 move = current_player.get_move(self.board)
 
@@ -76,68 +100,39 @@ class Game:
             if self.game_completed(current_player.player_number):
                 self.game_over = True
                 self.player_string.configure(text=self.players[self.current_turn].player_string + ' wins!')
+            elif is_full(self.board):
+                self.game_over = True
+                self.player_string.configure(text='Draw!')
             else:
+                opponent = self.players[int(not self.current_turn)]
+                if self.ponder and current_player.type == 'ai' and opponent.type != 'random':
+                    # the tables filled meanwhile carry over to the next move
+                    self.workers[self.current_turn].ponder(self.board, 'get_alpha_beta_move')
                 self.current_turn = int(not self.current_turn)
                 self.player_string.configure(text=self.players[self.current_turn].player_string)
 
     def update_board(self, move, player_num):
-        if 0 in self.board[:,move]:
-            update_row = -1
-            for row in range(1, self.board.shape[0]):
-                update_row = -1
-                if self.board[row, move] > 0 and self.board[row-1, move] == 0:
-                    update_row = row-1
-                elif row==self.board.shape[0]-1 and self.board[row, move] == 0:
-                    update_row = row
-
-                if update_row >= 0:
-                    self.board[update_row, move] = player_num
-                    self.c.itemconfig(self.gui_board[move][update_row],
-                                      fill=self.colors[self.current_turn])
-                    break
-        else:
+        row = drop_row(self.board, move)
+        if row is None:
             err = 'Invalid move by player {}. Column {}'.format(player_num, move)
             raise Exception(err)
-
+        self.board[row, move] = player_num
+        self.last_move = (row, move)
+        # only the new disc needs to be drawn
+        self.c.itemconfig(self.gui_board[move][row], fill=self.colors[self.current_turn])
 
     def game_completed(self, player_num):
-        player_win_str = '{0}{0}{0}{0}'.format(player_num)
-        board = self.board
-        to_str = lambda a: ''.join(a.astype(str))
-
-        def check_horizontal(b):
-            for row in b:
-                if player_win_str in to_str(row):
-                    return True
-            return False
-
-        def check_verticle(b):
-            return check_horizontal(b.T)
-
-        def check_diagonal(b):
-            for op in [None, np.fliplr]:
-                op_board = op(b) if op else b
-                
-                root_diag = np.diagonal(op_board, offset=0).astype(np.int)
-                if player_win_str in to_str(root_diag):
-                    return True
-
-                for i in range(1, b.shape[1]-3):
-                    for offset in [i, -i]:
-                        diag = np.diagonal(op_board, offset=offset)
-                        diag = to_str(diag.astype(np.int))
-                        if player_win_str in diag:
-                            return True
-
+        """only the lines through the last disc can have been completed"""
+        if self.last_move is None:
             return False
+        row, col = self.last_move
+        return (self.board[row, col] == player_num and
+                line_completed(self.board, row, col, self.connect))
 
-        return (check_horizontal(board) or
-                check_verticle(board) or
-                check_diagonal(board))
 
 
-
-def main(player1, player2, time):
+def main(player1, player2, time, workers=1, book=None, rows=6, cols=7, connect=CONNECT,
+         ponder=False):
     """
     Creates player objects based on the string paramters that are passed
     to it and calls play_game()
@@ -145,16 +140,22 @@ def main(player1, player2, time):
     INPUTS:
     player1 - a string ['ai', 'random', 'human']
     player2 - a string ['ai', 'random', 'human']
+    time - seconds an AI player has for each move
+    workers - processes an AI player searches with
+    book - path of an opening book file for AI players, or None
+    rows, cols - size of the board
+    connect - discs in a line needed to win
+    ponder - AI players search during the opponent's turn
     """
     def make_player(name, num):
         if name=='ai':
-            return AIPlayer(num)
+            return AIPlayer(num, time_limit=time, workers=workers, book=book, connect=connect)
         elif name=='random':
             return RandomPlayer(num)
         elif name=='human':
             return HumanPlayer(num)
 
-    Game(make_player(player1, 1), make_player(player2, 2), time)
+    Game(make_player(player1, 1), make_player(player2, 2), time, rows, cols, connect, ponder)
 
 
 def play_game(player1, player2):
@@ -181,6 +182,29 @@ if __name__=='__main__':
                         type=int,
                         default=60,
                         help='Time to wait for a move in seconds (int)')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='Processes an AI player searches with (int)')
+    parser.add_argument('--book',
+                        default=None,
+                        help='Opening book file built with OpeningBook.py')
+    parser.add_argument('--rows',
+                        type=int,
+                        default=6,
+                        help='Rows of the board (int)')
+    parser.add_argument('--cols',
+                        type=int,
+                        default=7,
+                        help='Columns of the board (int)')
+    parser.add_argument('--connect',
+                        type=int,
+                        default=CONNECT,
+                        help='Discs in a line needed to win (int)')
+    parser.add_argument('--ponder',
+                        action='store_true',
+                        help='AI players keep searching during the opponent\'s turn')
     args = parser.parse_args()
 
-    main(args.player1, args.player2, args.time)
\ No newline at end of file
+    main(args.player1, args.player2, args.time, args.workers, args.book,
+         args.rows, args.cols, args.connect, args.ponder)
\ No newline at end of file
@@ -0,0 +1,224 @@
+import json
+
+import numpy as np
+
+from Bitboard import CONNECT, mask_dtype
+
+"""
+Window evaluation: every group of four cells in a line (69 of them on the
+6x7 board) is scored from how many discs of each player it holds. Only
+windows that a single player can still complete count:
+
+    window with k discs of player 1 only  ->  +weights[k - 1]
+    window with k discs of player 2 only  ->  -weights[k - 1]
+    any other window                      ->  0
+
+The default weights follow the kernel_score weights in Player.py: two in a
+row is worth 1 and three in a row is worth 100. Other line lengths use
+windows of that length; the window and cell tables are built once per
+board geometry.
+
+Both evaluations are linear in their weights: window_features and
+kernel_features give the feature counts of a stack of boards, whose dot
+product with the weights is the evaluation. Tuner.py fits the weights with
+them and writes weight files read by load_weights.
+"""
+
+DEFAULT_WINDOW_WEIGHTS = (0, 1, 100)  # windows holding 1, 2, 3 discs
+WINDOW_LENGTH = CONNECT
+
+# kernel_score: rows and columns of the board holding these strings of
+# discs score their weight for player 1 (good) or against it (bad)
+GOOD_KERNELS = ('11', '101', '111', '1101', '1011')
+BAD_KERNELS = ('22', '21112', '2112', '202', '222', '2202', '2022')
+KERNEL_WEIGHTS = (1, 1, 100, 100, 100,  # good kernels
+                  1, 1, 1, 100, 100, 100, 100)  # bad kernels
+
+
+def default_weights(n=WINDOW_LENGTH):
+    """Weights for windows of n cells: one disc short of a line is worth 100, two short 1"""
+    return tuple([0] * (n - 3) + [1, 100])[-(n - 1):]
+
+
+def window_cells(rows, cols, n=WINDOW_LENGTH):
+    """All the n-cell lines of the board as lists of (row, col) cells"""
+    windows = []
+    for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        for row in range(rows):
+            for col in range(cols):
+                end_row, end_col = row + (n - 1) * dr, col + (n - 1) * dc
+                if 0 <= end_row < rows and 0 <= end_col < cols:
+                    windows.append([(row + i * dr, col + i * dc) for i in range(n)])
+    return windows
+
+
+def score_table(weights, n=WINDOW_LENGTH):
+    """table[n1][n2] is the score of a window with n1 and n2 discs of players 1 and 2"""
+    table = np.zeros([n + 1, n + 1], dtype=np.int64)
+    for k, w in enumerate(weights, start=1):
+        table[k, 0] = w
+        table[0, k] = -w
+    return table
+
+
+def kernel_features(boards):
+    """
+    (N, 12) counts of the rows and columns of an (N, rows, cols) stack of
+    boards holding every kernel, good kernels first and bad ones negated, so
+    kernel_score(b) + kernel_score(b.T) is features @ weights
+    """
+    boards = np.asarray(boards)
+    lines = [boards, boards.transpose(0, 2, 1)]  # rows, then columns as rows
+    features = []
+    for kernels, sign in [(GOOD_KERNELS, 1), (BAD_KERNELS, -1)]:
+        for k in kernels:
+            kernel = np.array([int(c) for c in k], dtype=boards.dtype)
+            count = np.zeros(len(boards), dtype=np.int64)
+            for line in lines:
+                if line.shape[2] < len(kernel):
+                    continue
+                # (N, lines, positions, len(kernel)) views of the line cells
+                windows = np.lib.stride_tricks.sliding_window_view(line, len(kernel), axis=2)
+                count += (windows == kernel).all(axis=3).any(axis=2).sum(axis=1)
+            features.append(sign * count)
+    return np.stack(features, axis=1)
+
+
+def save_weights(path, evaluation, weights, **info):
+    """Write evaluation weights as JSON, with any other information to keep"""
+    with open(path, 'w') as f:
+        json.dump(dict(info, evaluation=evaluation, weights=list(weights)), f, indent=2)
+
+
+def load_weights(path):
+    """(evaluation, weights) of a file written by save_weights"""
+    with open(path) as f:
+        data = json.load(f)
+    return data['evaluation'], tuple(data['weights'])
+
+
+_cell_bits = {}
+
+
+def unpack_masks(p1_masks, p2_masks, rows, cols):
+    """
+    (N, rows, cols) numpy boards from arrays of player 1 and player 2
+    bitboard masks; needs no weights, so any evaluation can use it
+    """
+    dtype = mask_dtype(rows, cols)
+    if (rows, cols) not in _cell_bits:
+        # bit index of every cell of the flat numpy board
+        _cell_bits[(rows, cols)] = np.array([c * (rows + 1) + (rows - 1 - r)
+                                             for r in range(rows) for c in range(cols)],
+                                            dtype=dtype)
+    cell_bits = _cell_bits[(rows, cols)]
+    one = np.array(1, dtype=dtype)
+    p1 = (np.asarray(p1_masks, dtype=dtype)[:, None] >> cell_bits) & one
+    p2 = (np.asarray(p2_masks, dtype=dtype)[:, None] >> cell_bits) & one
+    boards = (p1 + 2 * p2).astype(np.uint8)
+    return boards.reshape(-1, rows, cols)
+
+
+class WindowEvaluator:
+    def __init__(self, rows=6, cols=7, weights=DEFAULT_WINDOW_WEIGHTS, n=WINDOW_LENGTH):
+        if len(weights) != n - 1:
+            raise ValueError('{} weights given for windows of {} cells'.format(len(weights), n))
+        self.rows = rows
+        self.cols = cols
+        self.n = n
+        self.weights = tuple(weights)
+        cells = window_cells(rows, cols, n)
+        # flat numpy board index of every cell of every window, shape (W, n)
+        self.windows = np.array([[r * cols + c for r, c in w] for w in cells])
+        # the same windows in the bitboard layout
+        col_bits = rows + 1
+        self.window_bits = [[c * col_bits + (rows - 1 - r) for r, c in w] for w in cells]
+        self.window_masks = [sum(1 << b for b in bits) for bits in self.window_bits]
+        self.cell_windows = {}  # bit index -> windows going through the cell
+        for i, bits in enumerate(self.window_bits):
+            for b in bits:
+                self.cell_windows.setdefault(b, []).append(i)
+        self.table = score_table(self.weights, n)
+        self.table_rows = self.table.tolist()
+
+    def evaluate(self, board):
+        """Score of a numpy board, positive when player 1 is better"""
+        cells = board.reshape(-1)[self.windows]
+        n1 = (cells == 1).sum(axis=1)
+        n2 = (cells == 2).sum(axis=1)
+        return int(self.table[n1, n2].sum())
+
+    def evaluate_batch(self, boards):
+        """Scores of an (N, rows, cols) stack of numpy boards"""
+        boards = np.asarray(boards)
+        cells = boards.reshape(len(boards), -1)[:, self.windows]  # (N, W, n)
+        n1 = (cells == 1).sum(axis=2)
+        n2 = (cells == 2).sum(axis=2)
+        return self.table[n1, n2].sum(axis=1)
+
+    def window_features(self, boards):
+        """
+        (N, n - 1) features of an (N, rows, cols) stack of boards: windows
+        holding k discs of player 1 only minus those of player 2 only, so
+        evaluate_batch is features @ weights
+        """
+        boards = np.asarray(boards)
+        cells = boards.reshape(len(boards), -1)[:, self.windows]  # (N, W, n)
+        n1 = (cells == 1).sum(axis=2)
+        n2 = (cells == 2).sum(axis=2)
+        return np.stack([((n1 == k) & (n2 == 0)).sum(axis=1) - ((n2 == k) & (n1 == 0)).sum(axis=1)
+                         for k in range(1, self.n)], axis=1)
+
+    def unpack_masks(self, p1_masks, p2_masks):
+        """(N, rows, cols) numpy boards from arrays of player 1 and player 2 bitboard masks"""
+        return unpack_masks(p1_masks, p2_masks, self.rows, self.cols)
+
+    def evaluate_masks(self, p1_masks, p2_masks):
+        """Scores of positions given as bitboard masks, without building Bitboards"""
+        return self.evaluate_batch(self.unpack_masks(p1_masks, p2_masks))
+
+    def evaluate_state(self, state):
+        """Score of a Bitboard, same value as evaluate(state.to_array())"""
+        p1, p2 = state.masks
+        table = self.table_rows
+        score = 0
+        for m in self.window_masks:
+            score += table[bin(p1 & m).count('1')][bin(p2 & m).count('1')]
+        return score
+
+    def tracker(self, state):
+        return WindowTracker(self, state)
+
+
+class WindowTracker:
+    """
+    Incremental window score of a Bitboard. Once attached with
+    state.attach(tracker), play and undo keep score up to date by only
+    rescoring the windows through the cell that changed.
+    """
+
+    def __init__(self, evaluator, state):
+        self.evaluator = evaluator
+        self.counts = [[0, 0] for _ in evaluator.window_masks]
+        for i, m in enumerate(evaluator.window_masks):
+            self.counts[i] = [bin(state.masks[0] & m).count('1'),
+                              bin(state.masks[1] & m).count('1')]
+        self.score = evaluator.evaluate_state(state)
+
+    def play(self, index, player_num):
+        table = self.evaluator.table_rows
+        p = player_num - 1
+        for w in self.evaluator.cell_windows.get(index, ()):
+            counts = self.counts[w]
+            old = table[counts[0]][counts[1]]
+            counts[p] += 1
+            self.score += table[counts[0]][counts[1]] - old
+
+    def undo(self, index, player_num):
+        table = self.evaluator.table_rows
+        p = player_num - 1
+        for w in self.evaluator.cell_windows.get(index, ()):
+            counts = self.counts[w]
+            old = table[counts[0]][counts[1]]
+            counts[p] -= 1
+            self.score += table[counts[0]][counts[1]] - old
@@ -0,0 +1,445 @@
+# system libs
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import multiprocessing as mp
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import CONNECT
+from Player import AIPlayer, RandomPlayer
+from Rules import available_actions, game_completed, is_full, update_board
+
+"""
+asyncio game server: many games at once over TCP, one JSON object per line
+each way. The AI moves of every game are searched by one shared pool of
+processes.
+
+Requests carry an optional "id" that is echoed in the reply:
+
+    {"op": "new", "player1": "human", "player2": "ai", "time": 1}
+    {"op": "move", "game": 3, "col": 4}
+    {"op": "state", "game": 3}
+    {"op": "close", "game": 3}
+    {"op": "metrics"}
+
+new also takes rows, cols, connect and depth. Player types are 'human',
+'ai' and 'random'; after new and after every human move the server plays
+the AI and random turns until a human is to move or the game is over, then
+replies with the game state. A finished game can be read with state until
+it is closed, or for FINISHED_GAME_SECONDS after it ended.
+
+Every AI move has a deadline of time seconds from the moment it is
+requested; time spent waiting for a free process counts, so the search
+gets whatever is left. While max_queue AI moves are waiting for a process,
+new games and human moves are refused with a 'busy' error (so are new
+games beyond max_games games still going) and the client is expected to retry later; each
+connection also stops being read while it has max_inflight requests open.
+
+    python GameServer.py --port 4004 --workers 8
+    python GameServer.py --port 4004 --load 200     # play 200 games against it
+"""
+
+DEFAULT_PORT = 4004
+DEFAULT_MOVE_TIME = 1.0  # seconds per AI move
+DEADLINE_GRACE = 0.5  # seconds past its deadline before an AI move is given up on
+LATENCY_SAMPLES = 10000  # latest AI moves kept for the percentiles
+FINISHED_GAME_SECONDS = 60.0  # finished games not closed are dropped after this
+MAX_BOARD_SIDE = 16  # rows and cols of a new game
+MAX_MOVE_TIME = 60.0  # seconds per AI move of a new game
+
+# AIPlayer objects of a pool process, kept between moves so their tables are reused
+_players = {}
+
+
+def _ai_move(board, player_number, method, deadline, connect, max_depth):
+    """Run in a pool process: search board until deadline, return (move, stats dict)"""
+    key = (player_number, connect, max_depth)
+    if key not in _players:
+        _players[key] = AIPlayer(player_number, max_depth=max_depth, connect=connect)
+    player = _players[key]
+    # the time left once the request reached a process; deadline_for keeps its margins
+    player.time_limit = max(deadline - time.time(), 0.0)
+    move, stats = getattr(player, method)(board, return_stats=True)
+    return move, stats.as_dict()
+
+
+def int_field(request, name, default, low, high):
+    """Integer request[name] between low and high"""
+    value = request.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise ValueError('{} must be an integer from {} to {}'.format(name, low, high))
+    return value
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {'p50_ms': 1000 * p50, 'p90_ms': 1000 * p90, 'p99_ms': 1000 * p99,
+            'max_ms': 1000 * max(samples)}
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.start = time.time()
+        self.games_started = 0
+        self.games_finished = 0
+        self.moves = 0  # moves played in all games, by any player
+        self.ai_moves = 0
+        self.ai_timeouts = 0
+        self.rejected = 0  # requests refused with 'busy'
+        self.nodes = 0
+        self.search_seconds = 0.0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)  # request to reply
+        self.queue_waits = collections.deque(maxlen=LATENCY_SAMPLES)  # request to pool start
+
+    def as_dict(self, active_games, queued, running):
+        elapsed = time.time() - self.start
+        return {
+            'uptime_seconds': elapsed,
+            'active_games': active_games,
+            'games_started': self.games_started,
+            'games_finished': self.games_finished,
+            'moves': self.moves,
+            'moves_per_second': self.moves / elapsed if elapsed else 0.0,
+            'ai_moves': self.ai_moves,
+            'ai_timeouts': self.ai_timeouts,
+            'rejected': self.rejected,
+            'queued_ai_moves': queued,
+            'running_ai_moves': running,
+            'nodes_per_second': self.nodes / self.search_seconds if self.search_seconds else 0.0,
+            'ai_latency': percentiles(self.latencies),
+            'queue_wait': percentiles(self.queue_waits),
+        }
+
+
+class ServerGame:
+    def __init__(self, game_id, players, rows, cols, connect, time_limit, max_depth):
+        self.game_id = game_id
+        self.players = players  # 'human', 'ai' or 'random' for players 1 and 2
+        self.board = np.zeros([rows, cols]).astype(np.uint8)
+        self.connect = connect
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.current_turn = 0
+        self.history = []  # columns played
+        self.winner = None  # 1 or 2, 0 for a draw, None while playing
+        self.error = None  # why the game was stopped early
+        self.finished = None  # time the game ended
+        self.lock = asyncio.Lock()
+        self.random_players = [RandomPlayer(num) for num in (1, 2)]
+
+    @property
+    def over(self):
+        return self.winner is not None or self.error is not None
+
+    def play(self, col):
+        player_num = self.current_turn + 1
+        update_board(self.board, col, player_num)
+        self.history.append(col)
+        if game_completed(self.board, player_num, self.connect):
+            self.winner = player_num
+        elif is_full(self.board):
+            self.winner = 0
+        else:
+            self.current_turn = 1 - self.current_turn
+
+    def state(self):
+        return {'game': self.game_id, 'players': self.players, 'board': self.board.tolist(),
+                'to_move': None if self.over else self.current_turn + 1,
+                'moves': self.history, 'winner': self.winner, 'over': self.over,
+                'error': self.error}
+
+
+class Busy(Exception):
+    """The server is at its limit of games or queued AI moves"""
+
+
+class GameServer:
+    def __init__(self, workers=mp.cpu_count(), max_games=1000, max_queue=None, max_inflight=64):
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+        self.workers = workers
+        self.slots = asyncio.Semaphore(workers)  # AI moves handed to the pool at once
+        self.max_games = max_games
+        self.max_queue = max_queue if max_queue is not None else 8 * workers
+        self.max_inflight = max_inflight  # open requests per connection
+        self.games = {}
+        self.game_ids = itertools.count(1)
+        self.queued = 0  # AI moves waiting for a pool slot
+        self.running = 0  # AI moves in the pool
+        self.metrics = ServerMetrics()
+
+    async def ai_move(self, game):
+        """Best move of the AI to move in game, within the game's time limit"""
+        requested = time.time()
+        deadline = requested + game.time_limit
+        opponent = game.players[1 - game.current_turn]
+        method = 'get_expectimax_move' if opponent == 'random' else 'get_alpha_beta_move'
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.metrics.queue_waits.append(time.time() - requested)
+        if time.time() >= deadline:
+            # the whole time limit went by in the queue, there is none left to search
+            self.slots.release()
+            self.metrics.ai_timeouts += 1
+            raise Exception('Player {} Exceeded time limit'.format(game.current_turn + 1))
+        self.running += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self.pool, _ai_move, game.board.copy(), game.current_turn + 1, method,
+            deadline, game.connect, game.max_depth)
+        # the slot is only free once the process is, even if the move is given up on
+        future.add_done_callback(self.release_slot)
+        try:
+            move, stats = await asyncio.wait_for(
+                asyncio.shield(future), max(deadline - time.time(), 0) + DEADLINE_GRACE)
+        except asyncio.TimeoutError:
+            self.metrics.ai_timeouts += 1
+            raise Exception('Player {} Exceeded time limit'.format(game.current_turn + 1))
+        self.metrics.ai_moves += 1
+        self.metrics.latencies.append(time.time() - requested)
+        self.metrics.nodes += stats['nodes']
+        self.metrics.search_seconds += stats['elapsed']
+        return move
+
+    def release_slot(self, future):
+        """Done callback of an AI move in the pool"""
+        self.running -= 1
+        self.slots.release()
+        if not future.cancelled():
+            future.exception()  # a move given up on has nobody left to read its error
+
+    async def advance(self, game):
+        """Play the AI and random turns until a human is to move or the game is over"""
+        while not game.over and game.players[game.current_turn] != 'human':
+            if game.players[game.current_turn] == 'ai':
+                try:
+                    move = await self.ai_move(game)
+                except Exception as e:
+                    game.error = str(e)
+                    break
+            else:
+                move = game.random_players[game.current_turn].get_move(game.board)
+            game.play(int(move))
+            self.metrics.moves += 1
+        if game.over:
+            self.metrics.games_finished += 1
+            game.finished = time.time()
+
+    def active_games(self):
+        """
+        Number of games still going; finished games are dropped once they
+        have been over for FINISHED_GAME_SECONDS
+        """
+        expired = time.time() - FINISHED_GAME_SECONDS
+        active = 0
+        for game_id, game in list(self.games.items()):
+            if game.finished is None:
+                active += 1
+            elif game.finished < expired:
+                del self.games[game_id]
+        return active
+
+    def new_game(self, request):
+        """ServerGame for a new request, its options checked"""
+        players = [request.get('player1', 'human'), request.get('player2', 'ai')]
+        for p in players:
+            if p not in ('human', 'ai', 'random'):
+                raise ValueError('Unknown player type {}'.format(p))
+        rows = int_field(request, 'rows', 6, 1, MAX_BOARD_SIDE)
+        cols = int_field(request, 'cols', 7, 1, MAX_BOARD_SIDE)
+        connect = int_field(request, 'connect', CONNECT, 2, max(rows, cols))
+        depth = request.get('depth')
+        if depth is not None:
+            depth = int_field(request, 'depth', None, 1, rows * cols)
+        time_limit = request.get('time', DEFAULT_MOVE_TIME)
+        if (isinstance(time_limit, bool) or not isinstance(time_limit, (int, float))
+                or not 0 < time_limit <= MAX_MOVE_TIME):
+            raise ValueError('time must be a number of seconds above 0 and at most {}'.format(
+                MAX_MOVE_TIME))
+        return ServerGame(next(self.game_ids), players, rows, cols, connect, time_limit, depth)
+
+    async def handle(self, request):
+        """Reply to one request"""
+        op = request.get('op')
+        if op == 'metrics':
+            return self.metrics.as_dict(self.active_games(), self.queued, self.running)
+        if op in ('new', 'move') and self.queued >= self.max_queue:
+            # games already being played keep going, new work waits for the queue to drain
+            raise Busy('{} AI moves already queued'.format(self.queued))
+        if op == 'new':
+            active = self.active_games()
+            if active >= self.max_games:
+                raise Busy('{} games already running'.format(active))
+            game = self.new_game(request)
+            self.games[game.game_id] = game
+            self.metrics.games_started += 1
+            async with game.lock:
+                await self.advance(game)
+                return game.state()
+
+        game = self.games.get(request.get('game'))
+        if game is None:
+            raise ValueError('No game {}'.format(request.get('game')))
+        if op == 'state':
+            return game.state()
+        if op == 'close':
+            del self.games[game.game_id]
+            return {'game': game.game_id, 'closed': True}
+        if op == 'move':
+            async with game.lock:
+                if game.over:
+                    raise ValueError('Game {} is over'.format(game.game_id))
+                if game.players[game.current_turn] != 'human':
+                    raise ValueError('Not a human turn in game {}'.format(game.game_id))
+                col = int(request['col'])
+                if col not in available_actions(game.board):
+                    raise ValueError('Invalid move by player {}. Column {}'.format(
+                        game.current_turn + 1, col))
+                game.play(col)
+                self.metrics.moves += 1
+                # advance counts the game as finished if that move ended it
+                await self.advance(game)
+                return game.state()
+        raise ValueError('Unknown op {}'.format(op))
+
+    async def reply(self, line, writer, inflight):
+        request = None
+        try:
+            request = json.loads(line)
+            reply = {'ok': True}
+            reply.update(await self.handle(request))
+        except Busy as e:
+            self.metrics.rejected += 1
+            reply = {'ok': False, 'error': 'busy', 'detail': str(e)}
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+        if isinstance(request, dict) and 'id' in request:
+            reply['id'] = request['id']
+        writer.write((json.dumps(reply) + '\n').encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            inflight.release()
+
+    async def serve_connection(self, reader, writer):
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+        try:
+            while True:
+                # stop reading while the connection has too many open requests
+                await inflight.acquire()
+                line = await reader.readline()
+                if not line:
+                    inflight.release()
+                    break
+                task = asyncio.ensure_future(self.reply(line, writer, inflight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        print('Serving on {}:{} with {} AI processes'.format(host, port, self.workers))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+async def load_test(host, port, games, time_limit=0.2, opponent='random', retry=0.05):
+    """
+    Play games AI vs opponent games at once against a running server,
+    retrying refused ones after retry seconds; return the server metrics
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=2 ** 20)
+    loop = asyncio.get_running_loop()
+    pending = {}
+    request_ids = itertools.count()
+
+    async def request(message):
+        message['id'] = next(request_ids)
+        pending[message['id']] = future = loop.create_future()
+        writer.write((json.dumps(message) + '\n').encode())
+        await writer.drain()
+        return await future
+
+    async def read_replies():
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            pending.pop(reply['id']).set_result(reply)
+
+    busy = 0
+
+    async def play():
+        nonlocal busy
+        while True:
+            reply = await request({'op': 'new', 'player1': 'ai', 'player2': opponent,
+                                   'time': time_limit})
+            if reply.get('error') != 'busy':
+                break
+            busy += 1
+            await asyncio.sleep(retry)
+        if reply.get('ok'):
+            await request({'op': 'close', 'game': reply['game']})
+        return reply
+
+    reader_task = asyncio.ensure_future(read_replies())
+    start = time.time()
+    replies = await asyncio.gather(*[play() for _ in range(games)])
+    seconds = time.time() - start
+    metrics = await request({'op': 'metrics'})
+    writer.close()
+    reader_task.cancel()
+    metrics['load_test'] = {
+        'games': games,
+        'seconds': seconds,
+        'games_per_second': games / seconds,
+        'finished': sum(1 for r in replies if r.get('winner') is not None),
+        'errors': sum(1 for r in replies if not r.get('ok') or r.get('error')),
+        'busy_retries': busy,
+    }
+    return metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=mp.cpu_count(),
+                        help='Processes searching AI moves (int)')
+    parser.add_argument('--max-games', type=int, default=1000,
+                        help='Games still going at the same time (int)')
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help='AI moves waiting for a process before requests are refused (int)')
+    parser.add_argument('--load', type=int, default=None,
+                        help='Instead of serving, play this many AI vs random games '
+                             'against a running server and print its metrics (int)')
+    parser.add_argument('--time', type=float, default=0.2,
+                        help='Time for an AI move in the load test in seconds')
+    args = parser.parse_args()
+
+    if args.load is not None:
+        print(json.dumps(asyncio.run(load_test(args.host, args.port, args.load, args.time)),
+                         indent=2))
+    else:
+        server = GameServer(args.workers, args.max_games, args.max_queue)
+        asyncio.run(server.serve(args.host, args.port))
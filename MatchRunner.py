@@ -0,0 +1,187 @@
+# system libs
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import CONNECT
+from Player import AIPlayer, RandomPlayer
+from Rules import available_actions, game_completed, update_board
+
+"""
+Headless AI vs AI / AI vs random matches, many games in parallel, with the
+results printed as JSON:
+
+    python MatchRunner.py ai random --games 1000 --processes 8 --time 1 --seed 7
+    python MatchRunner.py ai ai --rows 7 --cols 9 --connect 5
+"""
+
+
+def make_player(name, num, time_limit, max_depth, seed, connect=CONNECT):
+    if name == 'ai':
+        return AIPlayer(num, time_limit=time_limit, max_depth=max_depth, connect=connect)
+    elif name == 'random':
+        return RandomPlayer(num, seed=seed)
+    raise ValueError('Unknown player type {}'.format(name))
+
+
+def play_game(task):
+    """
+    Play one game without a GUI, the same way Game.make_move does
+
+    RETURNS:
+    A dict with the winner (1, 2 or 0 for a tie), the player types in order,
+    whether they were swapped, the search time and nodes of every AI move and
+    the SearchStats of every AI move as dicts
+    """
+    names, swapped, time_limit, max_depth, seed, (rows, cols, connect) = task
+    players = [make_player(name, num, time_limit, max_depth, seed + num, connect)
+               for num, name in enumerate(names, start=1)]
+    board = np.zeros([rows, cols]).astype(np.uint8)
+    current_turn = 0
+    winner = 0
+    moves = 0
+    ai_moves = []  # (seconds, nodes) of every AI move
+    stats = []
+
+    while available_actions(board):
+        current_player = players[current_turn]
+        if current_player.type == 'ai':
+            if players[int(not current_turn)].type == 'random':
+                p_func = current_player.get_expectimax_move
+            else:
+                p_func = current_player.get_alpha_beta_move
+            start = time.time()
+            move, move_stats = p_func(board, return_stats=True)
+            ai_moves.append((time.time() - start, move_stats.nodes))
+            stats.append(move_stats.as_dict())
+        else:
+            move = current_player.get_move(board)
+
+        update_board(board, int(move), current_player.player_number)
+        moves += 1
+        if game_completed(board, current_player.player_number, connect):
+            winner = current_player.player_number
+            break
+        current_turn = int(not current_turn)
+
+    return {'players': names, 'swapped': swapped, 'winner': winner, 'moves': moves,
+            'ai_moves': ai_moves, 'stats': stats}
+
+
+def summarize(games, elapsed):
+    """Win/draw/loss counts and AI search statistics of a list of play_game results"""
+    # wins of the players as given on the command line, whichever side they played
+    wins = {'player1': 0, 'player2': 0}
+    draws = 0
+    latencies = []
+    nodes = 0
+    for game in games:
+        if game['winner'] == 0:
+            draws += 1
+        else:
+            side = game['winner'] - 1
+            if game['swapped']:
+                side = 1 - side
+            wins['player{}'.format(side + 1)] += 1
+        for seconds, move_nodes in game['ai_moves']:
+            latencies.append(seconds)
+            nodes += move_nodes
+
+    summary = {
+        'games': len(games),
+        'wins': wins,
+        'draws': draws,
+        'moves': sum(game['moves'] for game in games),
+        'elapsed_seconds': elapsed,
+        'ai_moves': len(latencies),
+        'nodes': nodes,
+        'nodes_per_second': nodes / sum(latencies) if latencies and sum(latencies) else 0.0,
+    }
+    if latencies:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        summary['move_latency_ms'] = {'p50': 1000 * p50, 'p90': 1000 * p90,
+                                      'p99': 1000 * p99, 'max': 1000 * max(latencies)}
+    return summary
+
+
+def write_stats(games, path):
+    """Write the SearchStats of every AI move as JSON lines, tagged with the game"""
+    with open(path, 'w') as f:
+        for i, game in enumerate(games):
+            for move_stats in game['stats']:
+                f.write(json.dumps(dict(move_stats, game=i)) + '\n')
+
+
+def run_matches(player1, player2, games, processes=1, time_limit=1, max_depth=None,
+                seed=0, alternate=False, stats_path=None, rows=6, cols=7, connect=CONNECT):
+    """
+    Play games between player1 and player2 ('ai' or 'random') over a pool of
+    processes and return the summary. With alternate the players swap sides
+    every other game. With stats_path the search statistics of every AI move
+    are written there as JSON lines.
+    """
+    geometry = (rows, cols, connect)
+    tasks = []
+    for i in range(games):
+        swapped = alternate and i % 2 == 1
+        names = (player2, player1) if swapped else (player1, player2)
+        tasks.append((names, swapped, time_limit, max_depth, seed + 2 * i, geometry))
+
+    start = time.time()
+    if processes > 1:
+        with mp.Pool(processes) as pool:
+            results = list(pool.imap(play_game, tasks))
+    else:
+        results = [play_game(task) for task in tasks]
+    summary = summarize(results, time.time() - start)
+    summary['players'] = [player1, player2]
+    summary['board'] = {'rows': rows, 'cols': cols, 'connect': connect}
+    if stats_path:
+        write_stats(results, stats_path)
+    return summary
+
+
+if __name__ == '__main__':
+    player_types = ['ai', 'random']
+    parser = argparse.ArgumentParser()
+    parser.add_argument('player1', choices=player_types)
+    parser.add_argument('player2', choices=player_types)
+    parser.add_argument('--games', type=int, default=100,
+                        help='Number of games to play (int)')
+    parser.add_argument('--processes', type=int, default=mp.cpu_count(),
+                        help='Games played at the same time (int)')
+    parser.add_argument('--time', type=float, default=1,
+                        help='Time for an AI move in seconds')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='Maximum AI search depth (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random players (int)')
+    parser.add_argument('--alternate', action='store_true',
+                        help='Swap the players every other game')
+    parser.add_argument('--output', default=None,
+                        help='File to write the JSON summary to instead of stdout')
+    parser.add_argument('--stats', default=None,
+                        help='File to write the search statistics of every AI move to (JSON lines)')
+    parser.add_argument('--rows', type=int, default=6,
+                        help='Rows of the board (int)')
+    parser.add_argument('--cols', type=int, default=7,
+                        help='Columns of the board (int)')
+    parser.add_argument('--connect', type=int, default=CONNECT,
+                        help='Discs in a line needed to win (int)')
+    args = parser.parse_args()
+
+    summary = run_matches(args.player1, args.player2, args.games, args.processes,
+                          args.time, args.depth, args.seed, args.alternate, args.stats,
+                          args.rows, args.cols, args.connect)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
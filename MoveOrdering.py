@@ -0,0 +1,81 @@
+"""
+Move ordering stages for the alpha-beta search. The search asks the stage for
+the order in which to try the moves of a node and reports every beta cutoff
+back to it, so the stages are interchangeable:
+
+    MoveOrdering - left to right, the order of available_actions
+    HeuristicOrdering - hash/PV move, killer moves, history table, center first
+"""
+
+
+def center_order(cols):
+    """Columns sorted from the center outwards, e.g. [3, 2, 4, 1, 5, 0, 6]"""
+    return sorted(range(cols), key=lambda c: (abs(2 * c - (cols - 1)), c))
+
+
+class MoveOrdering:
+    """Plain left to right order"""
+
+    def new_search(self):
+        """Called before every move search"""
+        pass
+
+    def order(self, state, actions, ply, hash_move=None):
+        return actions
+
+    def record_cutoff(self, state, move, player_num, ply, depth):
+        """Called when move caused a beta cutoff at ply"""
+        pass
+
+
+class HeuristicOrdering(MoveOrdering):
+    KILLERS = 2  # killer moves kept per ply
+
+    def __init__(self, use_hash_move=True, use_killers=True, use_history=True):
+        self.use_hash_move = use_hash_move
+        self.use_killers = use_killers
+        self.use_history = use_history
+        self.killers = []  # killers[ply] = most recent cutoff columns at ply
+        self.history = {}  # (player_num, bit index of the cell) -> score
+        self.static_rank = {}  # cols -> rank of every column in center_order
+
+    def new_search(self):
+        self.killers = []
+        # age the history so the previous move's statistics fade out
+        for key in list(self.history):
+            self.history[key] //= 2
+            if self.history[key] == 0:
+                del self.history[key]
+
+    def order(self, state, actions, ply, hash_move=None):
+        if state.cols not in self.static_rank:
+            self.static_rank[state.cols] = {c: r for r, c in enumerate(center_order(state.cols))}
+        rank = self.static_rank[state.cols]
+        killers = self.killers[ply] if self.use_killers and ply < len(self.killers) else []
+        player_num = state.to_move()
+
+        def score(a):
+            if self.use_hash_move and a == hash_move:
+                return (3, 0, 0)
+            if a in killers:
+                return (2, -killers.index(a), 0)
+            h = 0
+            if self.use_history:
+                cell = a * state.col_bits + state.heights[a]
+                h = self.history.get((player_num, cell), 0)
+            return (1, h, -rank[a])
+
+        return sorted(actions, key=score, reverse=True)
+
+    def record_cutoff(self, state, move, player_num, ply, depth):
+        if self.use_killers:
+            while len(self.killers) <= ply:
+                self.killers.append([])
+            killers = self.killers[ply]
+            if move in killers:
+                killers.remove(move)
+            killers.insert(0, move)
+            del killers[self.KILLERS:]
+        if self.use_history:
+            key = (player_num, move * state.col_bits + state.heights[move])
+            self.history[key] = self.history.get(key, 0) + depth * depth
@@ -0,0 +1,198 @@
+# system libs
+import argparse
+import multiprocessing as mp
+import struct
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import CONNECT, Bitboard
+
+"""
+Opening book: the best move of every position of the first plies, found by a
+deep alpha-beta search offline and stored in a file that is memory mapped
+and looked up in O(1).
+
+Positions are stored once for a position and its left-right mirror image,
+under the smaller of the two keys (Bitboard.canonical_key). The file is an
+open-addressing hash table:
+
+    header  - MAGIC, then rows, cols, connect, number of slots as uint32
+    keys    - uint64 per slot, 0 for an empty slot
+    moves   - int8 per slot, the best column for the canonical position
+
+Build one with
+
+    python OpeningBook.py book.bin --plies 8 --depth 10 --processes 16
+
+Keys are 64 bits, so books are limited to boards with (rows + 1) * cols <= 64.
+"""
+
+MAGIC = b'C4BOOK02'
+HEADER = struct.Struct('<8sIIII')
+EMPTY = 0  # never a position key, the bottom row bits are always set
+
+
+def _slot(key, index_mask):
+    """Start slot of key: Fibonacci hashing of the 64-bit key"""
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 20 & index_mask
+
+
+class OpeningBook:
+    def __init__(self, rows, cols, keys, moves, connect=CONNECT):
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.keys = keys
+        self.moves = moves
+        self.index_mask = len(keys) - 1
+
+    @classmethod
+    def load(cls, path):
+        """Memory map a book file written by write"""
+        with open(path, 'rb') as f:
+            magic, rows, cols, connect, n_slots = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception('{} is not an opening book'.format(path))
+        keys = np.memmap(path, dtype=np.uint64, mode='r', offset=HEADER.size, shape=(n_slots,))
+        moves = np.memmap(path, dtype=np.int8, mode='r', offset=HEADER.size + 8 * n_slots,
+                          shape=(n_slots,))
+        return cls(rows, cols, keys, moves, connect)
+
+    @staticmethod
+    def write(path, rows, cols, entries, connect=CONNECT):
+        """Write a {canonical key: move} dict as a book file"""
+        if (rows + 1) * cols > 64:
+            raise Exception('A {}x{} board does not fit in 64-bit book keys'.format(rows, cols))
+        # at most half full so probe sequences stay short
+        n_slots = 1
+        while n_slots < 2 * len(entries):
+            n_slots *= 2
+        keys = np.zeros(n_slots, dtype=np.uint64)
+        moves = np.full(n_slots, -1, dtype=np.int8)
+        index_mask = n_slots - 1
+        for key, move in entries.items():
+            i = _slot(key, index_mask)
+            while keys[i] != EMPTY:
+                i = (i + 1) & index_mask
+            keys[i] = key
+            moves[i] = move
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, rows, cols, connect, n_slots))
+            f.write(keys.tobytes())
+            f.write(moves.tobytes())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.keys))
+
+    def lookup_state(self, state):
+        """Book move for a Bitboard, or None if the position is not in the book"""
+        if (state.rows, state.cols, state.connect) != (self.rows, self.cols, self.connect):
+            return None
+        key, mirrored = state.canonical_key()
+        i = _slot(key, self.index_mask)
+        while True:
+            stored = int(self.keys[i])
+            if stored == EMPTY:
+                return None
+            if stored == key:
+                move = int(self.moves[i])
+                return self.cols - 1 - move if mirrored else move
+            i = (i + 1) & self.index_mask
+
+    def lookup(self, board, connect=CONNECT):
+        """Book move for a numpy board, or None"""
+        return self.lookup_state(Bitboard.from_array(board, connect))
+
+
+def book_positions(rows, cols, plies, connect=CONNECT):
+    """
+    Canonical positions reachable in at most plies moves where the game is
+    still going, as {canonical key: (player 1 mask, player 2 mask)}
+    """
+    from Player import terminal_state
+
+    positions = {}
+    frontier = [Bitboard(rows, cols, connect)]
+    for ply in range(plies + 1):
+        next_frontier = []
+        for state in frontier:
+            key, mirrored = state.canonical_key()
+            if key in positions:
+                continue
+            if mirrored:
+                positions[key] = tuple(state.mirror(m) for m in state.masks)
+            else:
+                positions[key] = tuple(state.masks)
+            if ply == plies:
+                continue
+            for a in state.available_actions():
+                child = state.copy()
+                child.play(a, child.to_move())
+                if terminal_state(child) is None and not child.is_full():
+                    next_frontier.append(child)
+        frontier = next_frontier
+    return positions
+
+
+_searcher = None
+
+
+def _init_searcher(depth, connect=CONNECT):
+    from Player import AIPlayer
+
+    global _searcher
+    _searcher = AIPlayer(1, time_limit=None, max_depth=depth, connect=connect)
+
+
+def _best_move(task):
+    """Search one book position, returning its key and best canonical move"""
+    key, rows, cols, masks = task
+    state = Bitboard.from_masks(rows, cols, *masks, connect=_searcher.connect)
+    move = _searcher.get_alpha_beta_move(state.to_array())
+    # the stored positions are canonical already, so no mirroring is needed
+    return key, move
+
+
+def build_book(path, rows=6, cols=7, plies=8, depth=10, processes=1, connect=CONNECT):
+    """Search every position of the first plies to depth and write the book to path"""
+    # checked before the search rather than by write, hours later
+    if (rows + 1) * cols > 64:
+        raise Exception('A {}x{} board does not fit in 64-bit book keys'.format(rows, cols))
+    positions = book_positions(rows, cols, plies, connect)
+    tasks = [(key, rows, cols, masks) for key, masks in positions.items()]
+    entries = {}
+    if processes > 1:
+        with mp.Pool(processes, initializer=_init_searcher, initargs=(depth, connect)) as pool:
+            for key, move in pool.imap_unordered(_best_move, tasks, chunksize=16):
+                entries[key] = move
+    else:
+        _init_searcher(depth, connect)
+        for task in tasks:
+            key, move = _best_move(task)
+            entries[key] = move
+    OpeningBook.write(path, rows, cols, entries, connect)
+    return len(entries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='Book file to write')
+    parser.add_argument('--plies', type=int, default=8,
+                        help='Positions with up to this many discs are searched (int)')
+    parser.add_argument('--depth', type=int, default=10,
+                        help='Search depth for every book position (int)')
+    parser.add_argument('--processes', type=int, default=mp.cpu_count(),
+                        help='Positions searched at the same time (int)')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=CONNECT,
+                        help='Discs in a line needed to win (int)')
+    args = parser.parse_args()
+
+    start = time.time()
+    n = build_book(args.path, args.rows, args.cols, args.plies, args.depth, args.processes,
+                   args.connect)
+    print('{} positions written to {} in {:.1f}s'.format(n, args.path, time.time() - start))
@@ -0,0 +1,275 @@
+import math
+import multiprocessing as mp
+import time
+
+from Bitboard import Bitboard
+from MoveOrdering import center_order
+
+"""
+Root-splitting parallel alpha-beta. Every root move is a task for a pool of
+worker processes; each worker runs iterative deepening on its move until the
+deadline. The best root score found so far at every depth is kept in shared
+memory so a worker searching depth d starts with the alpha bound already
+established by the other workers at that depth.
+
+Scores in the shared array are from the point of view of the root player
+(sign * value, sign being -1 when player 2 is to move), so larger is always
+better for the player searching.
+
+The pool of a player (RootPool) is started at its first parallel search and
+kept for the following moves, so the workers start once per game and their
+transposition and history tables carry over from move to move, like the
+table of the player in AIWorker.
+
+The workers also write the score of every root move at every depth to
+shared memory as they finish it. While they search, the parent reads them
+to report the best move so far (AIPlayer.report_progress) and passes a
+cancelled search on to the workers through a shared flag, so a parallel
+search can be polled and stopped like a serial one. A search without a
+deadline runs in passes of doubling length, every pass sharing its time
+between the moves like a timed search and picking up at the depths the
+last one reached, so every move keeps getting deeper until it is cancelled.
+"""
+
+PROGRESS_INTERVAL = 0.05  # seconds between two looks of the parent at the workers
+FIRST_PASS_SECONDS = 0.5  # length of the first pass of a search without a deadline
+
+# set in every worker by _init_worker
+_player = None
+_shared = None
+
+
+class _SharedFlag:
+    """cancel_event of the player in a worker: set by the parent through a shared value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def is_set(self):
+        return self.value.value != 0
+
+
+def _init_worker(player, shared):
+    global _player, _shared
+    _player = player
+    _player.workers = 1
+    _player.root_pool = None
+    _player.on_progress = None
+    _player.cancel_event = _SharedFlag(shared.cancel)
+    _shared = shared
+
+
+class RootPool:
+    """Worker processes searching the root moves of one player, for one board size"""
+
+    def __init__(self, player, workers, rows, cols):
+        self.workers = workers
+        self.rows = rows
+        self.cols = cols
+        self.depths = rows * cols + 2
+        self.shared_best = mp.Array('d', self.depths)
+        # score of root move m at depth d at m * depths + d, NaN until searched,
+        # and whether it is exact; both under the lock of scores
+        self.scores = mp.Array('d', cols * self.depths)
+        self.exact = mp.Array('b', cols * self.depths, lock=False)
+        self.cancel = mp.Value('b', 0)
+        self.pool = mp.Pool(workers, initializer=_init_worker, initargs=(player, self))
+
+    def __getstate__(self):
+        # only the shared memory goes to the workers
+        state = dict(self.__dict__)
+        state['pool'] = None
+        return state
+
+    def fits(self, workers, rows, cols):
+        return (self.workers, self.rows, self.cols) == (workers, rows, cols)
+
+    def new_search(self):
+        """Forget the bounds and scores of the previous move"""
+        with self.shared_best.get_lock():
+            self.shared_best[:] = [-float('inf')] * len(self.shared_best)
+        with self.scores.get_lock():
+            self.scores[:] = [float('nan')] * len(self.scores)
+            self.exact[:] = [0] * len(self.exact)
+        self.cancel.value = 0
+
+    def add_result(self, move, depth, score, exact):
+        with self.scores.get_lock():
+            self.scores[move * self.depths + depth] = score
+            self.exact[move * self.depths + depth] = exact
+
+    def result(self, move, depth):
+        """(score, exact) of move at depth, None if it was not searched yet"""
+        with self.scores.get_lock():
+            score = self.scores[move * self.depths + depth]
+            exact = self.exact[move * self.depths + depth]
+        return None if math.isnan(score) else (score, bool(exact))
+
+    def results(self, actions):
+        """{move: [(depth, score, exact), ...]} of the depths searched so far"""
+        with self.scores.get_lock():
+            scores = self.scores[:]
+            exact = self.exact[:]
+        results = {}
+        for a in actions:
+            start = a * self.depths
+            results[a] = [(d, scores[start + d], bool(exact[start + d]))
+                          for d in range(1, self.depths) if not math.isnan(scores[start + d])]
+        return results
+
+    def close(self):
+        self.pool.terminate()
+
+
+def _search_root_move(board, move, max_depth, deadline):
+    """
+    Iterative deepening on one root move. Returns the move, the search
+    counters of the worker (AIPlayer.counters) and whether the move was
+    searched to the end, not stopped by the deadline; the (depth, score,
+    exact) result of every depth goes to the shared scores, score being from
+    the root player's point of view and exact False when the search failed
+    low and score is only an upper bound. Depths an earlier pass searched
+    are not searched again.
+    """
+    from Player import SearchTimeout, WIN_SCORE
+
+    player = _player
+    state = player.search_state(board)
+    player_num = state.to_move()
+    sign = 1 if player_num == 1 else -1
+    state.play(move, player_num)
+    player.reset_counters()
+    player.move_ordering.new_search()
+    for d in range(1, max_depth + 1):
+        known = _shared.result(move, d)
+        if known is not None:
+            score, exact = known
+            if exact and abs(score) >= WIN_SCORE:
+                break
+            continue
+        if d > 1 and player.cancelled():
+            return move, player.counters(), False
+        player.root_depth = d
+        # depth 1 always completes so every move gets a score, the others
+        # stop at the deadline or when the parent cancels the search
+        player.deadline = (deadline if deadline is not None else float('inf')) if d > 1 else None
+        with _shared.shared_best.get_lock():
+            bound = _shared.shared_best[d]
+        try:
+            if player_num == 1:
+                v = player.min_value(state, bound, float('inf'), d - 1)
+            else:
+                v = player.max_value(state, -float('inf'), -bound, d - 1)
+        except SearchTimeout:
+            return move, player.counters(), False
+        finally:
+            player.deadline = None
+        score = sign * v
+        exact = score > bound
+        _shared.add_result(move, d, score, exact)
+        with _shared.shared_best.get_lock():
+            if score > _shared.shared_best[d]:
+                _shared.shared_best[d] = score
+        if exact and abs(score) >= WIN_SCORE:
+            break  # the result of this move is decided
+    return move, player.counters(), True
+
+
+def _score_at(results, depth, max_depth):
+    """(score, exact) of a move at depth, or None if it was not searched that deep"""
+    from Player import WIN_SCORE
+
+    for d, score, exact in results:
+        if d == depth:
+            return score, exact
+    if results:
+        d, score, exact = results[-1]
+        # decided results and searches to the end of the game hold at any depth
+        if exact and (abs(score) >= WIN_SCORE or d == max_depth):
+            return score, exact
+    return None
+
+
+def _best_move(results, actions, max_depth):
+    """
+    (move, depth, score) of the best move at the deepest depth every move
+    was searched to, None before they all finished depth 1
+    """
+    for depth in range(max_depth, 0, -1):
+        scores = {a: _score_at(results[a], depth, max_depth) for a in actions}
+        if any(s is None for s in scores.values()):
+            continue
+        best_action, best_key = None, None
+        for a in actions:
+            score, exact = scores[a]
+            # on equal scores an exact value beats an upper bound
+            key = (score, exact)
+            if best_key is None or key > best_key:
+                best_action, best_key = a, key
+        return best_action, depth, best_key[0]
+    return None
+
+
+def parallel_root_search(player, board, workers, deadline):
+    """
+    Best move for board searched by player with workers processes until
+    deadline (None to search until cancelled), the player's counters and
+    depth_reached are updated with the combined search
+    """
+    start = time.time()
+    state = Bitboard.from_array(board, player.connect)
+    searched = player.root_actions(state)
+    actions = [c for c in center_order(state.cols) if c in searched]
+    sign = 1 if state.to_move() == 1 else -1
+    max_depth = state.rows * state.cols - state.move_count
+    if player.max_depth is not None:
+        max_depth = min(max_depth, player.max_depth)
+
+    pool = player.root_pool
+    if pool is None or not pool.fits(workers, state.rows, state.cols):
+        if pool is not None:
+            pool.close()
+        pool = player.root_pool = RootPool(player, workers, state.rows, state.cols)
+    pool.new_search()
+
+    # with fewer workers than moves the moves are searched in rounds, each
+    # round getting an equal slice of the time
+    workers = min(workers, len(actions))
+    rounds = (len(actions) + workers - 1) // workers
+    pass_start, pass_seconds = start, FIRST_PASS_SECONDS
+    reported = 0
+    while True:
+        pass_end = deadline if deadline is not None else pass_start + pass_seconds
+        tasks = []
+        for i, a in enumerate(actions):
+            task_deadline = pass_start + (pass_end - pass_start) * (i // workers + 1) / rounds
+            tasks.append((board, a, max_depth, task_deadline))
+        try:
+            pending = pool.pool.starmap_async(_search_root_move, tasks, chunksize=1)
+            while not pending.ready():
+                pending.wait(PROGRESS_INTERVAL)
+                if player.cancelled():
+                    pool.cancel.value = 1
+                best = _best_move(pool.results(actions), actions, max_depth)
+                if best is not None and best[1] > reported:
+                    move, reported, score = best
+                    player.report_progress('parallel', move, sign * score, reported, [move])
+            outcomes = pending.get()
+        except BaseException:
+            # the workers may still be searching, start afresh next move
+            pool.close()
+            player.root_pool = None
+            raise
+        for _, counters, _ in outcomes:
+            player.add_counters(counters)
+        if (deadline is not None or player.cancelled()
+                or all(finished for _, _, finished in outcomes)):
+            break
+        pass_start, pass_seconds = time.time(), 2 * pass_seconds
+
+    best_action = actions[0]
+    best = _best_move(pool.results(actions), actions, max_depth)
+    if best is not None:
+        best_action, player.depth_reached, score = best
+        player.root_value = sign * score
+    return best_action
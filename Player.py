@@ -1,134 +1,590 @@
+import time
+
 import numpy as np
 
+from Bitboard import CONNECT, Bitboard
+from Evaluation import (BAD_KERNELS, GOOD_KERNELS, KERNEL_WEIGHTS, WindowEvaluator,
+                        default_weights, kernel_features, load_weights, unpack_masks)
+from MoveOrdering import HeuristicOrdering, center_order
+from OpeningBook import OpeningBook
+from ParallelSearch import parallel_root_search
+from Rules import available_actions, game_completed
+from SearchHandle import SearchHandle
+from SearchStats import SearchStats
+from Solver import Solver, SolverTimeout
+from TranspositionTable import (DEFAULT_TT_BYTES, EXACT, LOWER, UPPER,
+                                TranspositionTable, bound_flag)
+
 """ 
 Player 1: max player
 Player 2: min player
 """
 
-def update_board(board, move, player_num):
-    """update the game board to move to more depth in the ge tree"""
-    if 0 in board[:, move]:
-        update_row = -1
-        for row in range(1, board.shape[0]):
-            update_row = -1
-            if board[row, move] > 0 and board[row - 1, move] == 0:
-                update_row = row - 1
-            elif row == board.shape[0] - 1 and board[row, move] == 0:
-                update_row = row
-
-            if update_row >= 0:
-                board[update_row, move] = player_num
-                break
-    else:
-        err = 'Invalid move by player {}. Column {}'.format(player_num, move)
-        raise Exception(err)
-    return board
-
-def game_completed(board, player_num):
-    """check if the player has won the game"""
-    player_win_str = '{0}{0}{0}{0}'.format(player_num)
-    to_str = lambda a: ''.join(a.astype(str))
-
-    def check_horizontal(b):
-        for row in b:
-            if player_win_str in to_str(row):
-                return True
-        return False
-
-    def check_vertical(b):
-        return check_horizontal(b.T)
-
-    def check_diagonal(b):
-        for op in [None, np.fliplr]:
-            op_board = op(b) if op else b
-
-            root_diag = np.diagonal(op_board, offset=0).astype(np.int)
-            if player_win_str in to_str(root_diag):
-                return True
-
-            for i in range(1, b.shape[1] - 3):
-                for offset in [i, -i]:
-                    diag = np.diagonal(op_board, offset=offset)
-                    diag = to_str(diag.astype(np.int))
-                    if player_win_str in diag:
-                        return True
-
-        return False
-
-    return (check_horizontal(board) or
-            check_vertical(board) or
-            check_diagonal(board))
-
-def terminal_state(board):
+WIN_SCORE = 100000
+
+DEFAULT_TIME_LIMIT = 60  # seconds per move, same as ConnectFour.py --time
+TIME_SAFETY = 0.8  # fraction of the turn limit the search may use
+TIME_MARGIN = 0.1  # seconds kept for process start-up and sending the move
+TIME_CHECK_NODES = 64  # nodes between two looks at the clock
+EVAL_BOUND = WIN_SCORE - 1  # heuristic values stay strictly inside the win scores
+EXP_SIDE_SALT = 0x5BD1E995  # xored into the expectimax cache keys when the AI is player 2
+DEFAULT_SOLVER_EMPTIES = 16  # empty cells left when the exact solver takes over
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the move deadline has passed"""
+
+def terminal_state(board, connect=CONNECT):
     """ Check who won the game and return the utility """
-    if game_completed(board, player_num=1):
-        return 100000
-    elif game_completed(board, player_num=2):
-        return -100000
-    else:
+    if isinstance(board, Bitboard):
+        # only the player who just moved can have completed a line
+        player_num = board.last_player()
+        if player_num is not None and board.has_won(player_num):
+            return WIN_SCORE if player_num == 1 else -WIN_SCORE
         return None
 
-
-def available_actions(board):
-    """ Given the current game state returns the valid columns """
-    valid_cols = []
-    for col in range(board.shape[1]):
-        if 0 in board[:, col]:
-            valid_cols.append(col)
-    return valid_cols
+    if game_completed(board, player_num=1, connect=connect):
+        return WIN_SCORE
+    elif game_completed(board, player_num=2, connect=connect):
+        return -WIN_SCORE
+    else:
+        return None
 
 
 class AIPlayer:
-    def __init__(self, player_number):
+    def __init__(self, player_number, time_limit=DEFAULT_TIME_LIMIT,
+                 max_depth=None, tt_bytes=DEFAULT_TT_BYTES, move_ordering=None,
+                 evaluation='window', weights=None,
+                 batch_leaves=False, workers=1, book=None,
+                 solver_empties=DEFAULT_SOLVER_EMPTIES, star2=False, symmetry=True,
+                 search='alphabeta', aspiration=None, connect=CONNECT, threats=True):
         self.player_number = player_number
         self.type = 'ai'
         self.player_string = 'Player {}:ai'.format(player_number)
+        self.time_limit = time_limit  # None searches to max_depth regardless of time
+        self.max_depth = max_depth  # None searches up to the end of the game
+        self.tt = TranspositionTable(max_bytes=tt_bytes)
+        self.move_ordering = move_ordering if move_ordering is not None else HeuristicOrdering()
+        self.connect = connect  # discs in a line needed to win, the board shape gives its size
+        # 'window' scores all connect-cell windows, 'kernel' is the original
+        # kernel_score, written for connect 4 only
+        if evaluation == 'kernel' and connect != 4:
+            raise ValueError('The kernel evaluation only plays connect 4')
+        if isinstance(weights, str):
+            # weight file written by Tuner.py
+            path = weights
+            file_evaluation, weights = load_weights(path)
+            if file_evaluation != evaluation:
+                raise ValueError('{} holds {} weights, not {}'.format(path, file_evaluation,
+                                                                      evaluation))
+        self.evaluation = evaluation
+        # window weights for 1 .. connect - 1 discs, or the good then bad
+        # kernel weights; None for default_weights / KERNEL_WEIGHTS
+        if weights is None:
+            weights = KERNEL_WEIGHTS if evaluation == 'kernel' else default_weights(connect)
+        elif evaluation == 'kernel' and len(weights) != len(KERNEL_WEIGHTS):
+            raise ValueError('{} weights given for {} kernels'.format(len(weights),
+                                                                    len(KERNEL_WEIGHTS)))
+        self.weights = tuple(weights)
+        self.window_evaluators = {}  # (rows, cols) -> WindowEvaluator
+        # evaluate all the leaves below a depth 1 node in one batch
+        self.batch_leaves = batch_leaves
+        self.workers = workers  # processes searching the root moves in parallel
+        self.root_pool = None  # ParallelSearch.RootPool, started by the first parallel search
+        # OpeningBook, or the path of a book file, consulted before searching
+        self.book = OpeningBook.load(book) if isinstance(book, str) else book
+        # solve positions with at most this many empty cells exactly, None never does
+        self.solver_empties = solver_empties
+        self.solvers = {}  # (rows, cols) -> Solver, kept for its transposition table
+        self.solution = None  # (result, plies to the end, score) of the last solved move
+        # expectimax against the random player: its own cache, values from the AI's side
+        self.exp_tt = TranspositionTable(max_bytes=tt_bytes)
+        # probe chance nodes for lower bounds before searching them; costs more
+        # nodes than it saves with this evaluation, see the README
+        self.star2 = star2
+        # share cache entries between a position and its mirror image, and
+        # search only half the root moves of a symmetric position
+        self.symmetry = symmetry
+        # 'alphabeta' searches every move with the full window, 'pvs' only the
+        # first one and the others with a null window, re-searched if they fail high
+        self.search = search
+        # half width of the window around the previous iteration's value the
+        # root is searched with, None for a full window
+        self.aspiration = aspiration
+        # settle nodes with an immediate win or two threats to block without
+        # searching, and search only the moves that do not lose at once
+        self.threats = threats
+        self.exp_player = player_number
+        self.exp_sign = 1
+        self.exp_salt = 0
+        self.center_rank = {}
+        self.deadline = None
+        self.root_depth = 0
+        self.last_stats = None  # SearchStats of the last move
+        # anytime search: an object with is_set() that stops the search at its
+        # next look at the clock, and a function called with best_so_far
+        # every time it changes
+        self.cancel_event = None
+        self.on_progress = None
+        self.reset_counters()
+
+    def __getstate__(self):
+        # the anytime hooks belong to the process that set them
+        state = dict(self.__dict__)
+        state['cancel_event'] = None
+        state['on_progress'] = None
+        # and so do the worker processes of the parallel search
+        state['root_pool'] = None
+        return state
+
+    def close(self):
+        """Stop the worker processes of the parallel search, if any"""
+        if self.root_pool is not None:
+            self.root_pool.close()
+            self.root_pool = None
+
+    def reset_counters(self):
+        """Zero the search counters at the start of a move"""
+        self.nodes = 0
+        self.terminal_nodes = 0
+        self.leaf_nodes = 0
+        self.iteration_nodes = []  # nodes searched by each completed iteration
+        self.iteration_times = []  # seconds taken by each completed iteration
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0  # cutoffs caused by the first move tried
+        self.cutoffs_by_index = []
+        self.depth_reached = 0
+        self.root_value = None  # value of the move played for player 1, None if not searched
+        self.best_so_far = None  # see report_progress
+        self.tt_start = self.tt_counts()
+
+    def tt_counts(self):
+        """(hits, probes) of all the tables of the player so far"""
+        tables = [self.tt, self.exp_tt] + [solver.tt for solver in self.solvers.values()]
+        hits = sum(table.hits for table in tables)
+        return hits, hits + sum(table.misses for table in tables)
+
+    def counters(self):
+        """Search counters since reset_counters, as merged by add_counters"""
+        hits, probes = self.tt_counts()
+        return {'nodes': self.nodes, 'terminal_nodes': self.terminal_nodes,
+                'leaf_nodes': self.leaf_nodes, 'cutoffs_by_index': list(self.cutoffs_by_index),
+                'tt_hits': hits - self.tt_start[0], 'tt_probes': probes - self.tt_start[1]}
+
+    def add_counters(self, counters):
+        """Add the counters of a search run elsewhere, e.g. in a worker process"""
+        self.nodes += counters['nodes']
+        self.terminal_nodes += counters['terminal_nodes']
+        self.leaf_nodes += counters['leaf_nodes']
+        for i, n in enumerate(counters['cutoffs_by_index']):
+            self.count_cutoff(i, n)
+        self.tt_start = (self.tt_start[0] - counters['tt_hits'],
+                         self.tt_start[1] - counters['tt_probes'])
+
+    def search_stats(self, method, source, move, start):
+        """SearchStats of the move just searched, also kept as last_stats"""
+        stats = SearchStats(method, self.player_number)
+        counters = self.counters()
+        stats.source = source
+        stats.move = None if move is None else int(move)
+        stats.elapsed = time.time() - start
+        stats.nodes = counters['nodes']
+        stats.terminal_nodes = counters['terminal_nodes']
+        stats.leaf_nodes = counters['leaf_nodes']
+        stats.cutoffs_by_index = counters['cutoffs_by_index']
+        stats.tt_hits = counters['tt_hits']
+        stats.tt_probes = counters['tt_probes']
+        stats.depth_reached = self.depth_reached
+        stats.value = self.root_value
+        stats.iterations = [(d + 1, n, t) for d, (n, t) in
+                            enumerate(zip(self.iteration_nodes, self.iteration_times))]
+        self.last_stats = stats
+        return stats
+
+    def window_evaluator(self, rows, cols):
+        if (rows, cols) not in self.window_evaluators:
+            self.window_evaluators[(rows, cols)] = WindowEvaluator(rows, cols, self.weights,
+                                                                   self.connect)
+        return self.window_evaluators[(rows, cols)]
+
+    def search_state(self, board):
+        """Bitboard for a search from board, tracking the window score if used"""
+        state = Bitboard.from_array(board, self.connect)
+        if self.evaluation == 'window':
+            state.attach(self.window_evaluator(state.rows, state.cols).tracker(state))
+        return state
+
+    def leaf_value(self, state):
+        """Evaluation of a search state at the depth limit"""
+        self.leaf_nodes += 1
+        if state.tracker is not None:
+            return state.tracker.score
+        return self.evaluation_function(state.to_array())
+
+    def batch_frontier_value(self, state, player_num, actions):
+        """
+        Value of a depth 1 node: every child is generated first and the
+        non-terminal ones are scored together with one evaluate_masks call.
+        This gives up alpha-beta pruning on the last ply in exchange for a
+        single NumPy call per frontier node. Only the columns actions are played.
+        """
+        p1_masks, p2_masks, values = [], [], []
+        for a in actions:
+            state.play(a, player_num)
+            self.nodes += 1
+            utility = terminal_state(state)
+            if utility is not None:
+                self.terminal_nodes += 1
+                state.undo()
+                return utility  # nothing beats winning
+            if state.is_full():
+                self.terminal_nodes += 1
+                values.append(0)
+            else:
+                self.leaf_nodes += 1
+                p1_masks.append(state.masks[0])
+                p2_masks.append(state.masks[1])
+            state.undo()
+        if p1_masks:
+            if self.evaluation == 'window':
+                evaluator = self.window_evaluator(state.rows, state.cols)
+                scores = evaluator.evaluate_masks(p1_masks, p2_masks)
+            else:
+                # self.weights holds the kernel weights, no window evaluator fits them
+                scores = self.evaluate_batch(unpack_masks(p1_masks, p2_masks, state.rows,
+                                                          state.cols))
+            values.extend(int(v) for v in scores)
+        return max(values) if player_num == 1 else min(values)
+
+    def evaluate_batch(self, boards):
+        """
+        Evaluate a stack of boards at once
+
+        INPUTS:
+        boards - an (N, rows, cols) uint8 numpy array of boards using the
+                 encoding of evaluation_function
+
+        RETURNS:
+        An array with the N evaluation_function values
+        """
+        boards = np.asarray(boards)
+        if self.evaluation == 'window':
+            return self.window_evaluator(*boards.shape[1:]).evaluate_batch(boards)
+        # self.weights holds the kernel weights, kernel_features counts their matches
+        return kernel_features(boards) @ np.array(self.weights, dtype=np.int64)
+
+    def solve_move(self, board, deadline=None):
+        """
+        Exact best move for board from the endgame solver, or None if it did
+        not finish by deadline. Sets self.solution to the proven result.
+        """
+        state = Bitboard.from_array(board, self.connect)
+        if (state.rows, state.cols) not in self.solvers:
+            self.solvers[(state.rows, state.cols)] = Solver(state.rows, state.cols,
+                                                            connect=self.connect)
+        solver = self.solvers[(state.rows, state.cols)]
+        try:
+            move, score = solver.best_move(state, deadline, self.cancel_event)
+        except SolverTimeout:
+            self.nodes += solver.nodes
+            return None
+        result, plies = solver.result(score, state.move_count)
+        self.solution = (result, plies, score)
+        # proven results on the scale of the search, for player 1
+        sign = 1 if state.to_move() == 1 else -1
+        self.root_value = sign * WIN_SCORE * ((score > 0) - (score < 0))
+        self.nodes += solver.nodes
+        self.depth_reached = state.rows * state.cols - state.move_count
+        return move
+
+    def effective_branching_factor(self):
+        """Node growth between the last two completed iterations"""
+        if len(self.iteration_nodes) < 2 or self.iteration_nodes[-2] == 0:
+            return None
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+    def deadline_for(self, start):
+        """Time at which a search started at start has to stop"""
+        if self.time_limit is None:
+            return None
+        return start + max(self.time_limit * TIME_SAFETY - TIME_MARGIN, 0.01)
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def out_of_time(self):
+        """True past the deadline of the iteration being searched or once cancelled"""
+        return time.time() > self.deadline or self.cancelled()
+
+    def report_progress(self, source, move, value, depth, pv):
+        """
+        Keep the best move found so far, with its value for player 1, the
+        depth it was searched to and the principal variation starting with
+        it, and pass it on to on_progress
+        """
+        self.best_so_far = {'move': int(move), 'value': value, 'depth': depth,
+                            'pv': [int(m) for m in pv], 'source': source, 'nodes': self.nodes}
+        if self.on_progress is not None:
+            self.on_progress(self.best_so_far)
+
+    def principal_variation(self, state, move, depth):
+        """move and the best replies stored in the table after it, at most depth moves"""
+        pv = [move]
+        state.play(move, state.to_move())
+        while len(pv) < depth and terminal_state(state) is None and not state.is_full():
+            key, mirrored = self.cache_key(state)
+            entry = self.tt.peek(key)
+            if entry is None or entry[3] is None:
+                break
+            reply = state.mirror_col(entry[3]) if mirrored else entry[3]
+            if not state.can_play(reply):
+                break
+            pv.append(reply)
+            state.play(reply, state.to_move())
+        for _ in pv:
+            state.undo()
+        return pv
+
+    def start_search(self, board, method='get_alpha_beta_move'):
+        """Run method(board) in a background thread, see SearchHandle"""
+        return SearchHandle(self, board, method)
+
+    def cache_key(self, state):
+        """
+        Key of state in the caches and whether it is the mirror image's; the
+        moves stored under a mirrored key are mirrored too
+        """
+        if self.symmetry:
+            return state.canonical_hash()
+        return state.hash, False
+
+    def probe(self, table, key, mirrored, state):
+        """table entry for key with its move mapped back onto state, or None"""
+        entry = table.probe(key)
+        if entry is not None and mirrored and entry[3] is not None:
+            value, entry_depth, flag, move = entry
+            entry = (value, entry_depth, flag, state.mirror_col(move))
+        return entry
+
+    def store(self, table, key, mirrored, state, value, depth, flag, best_move=None):
+        if mirrored and best_move is not None:
+            best_move = state.mirror_col(best_move)
+        table.store(key, value, depth, flag, best_move)
+
+    def root_actions(self, state):
+        """
+        Root moves worth searching: on a position that is its own mirror
+        image, the moves right of the center are the same as those left of it
+        """
+        actions = state.available_actions()
+        if self.symmetry and state.is_symmetric():
+            actions = [a for a in actions if a <= state.mirror_col(a)]
+        return actions
+
+    def mirror_values(self, state, action_values):
+        """Fill in the values of the moves skipped by root_actions"""
+        for a in range(state.cols):
+            if action_values[a] is None and state.can_play(a):
+                action_values[a] = action_values[state.mirror_col(a)]
+        return action_values
 
     def max_value(self, state, alpha, beta, depth):
         """max value calculation for alpha-beta Minimax algorithm"""
-        action_values = [0 for _ in range(state.shape[1])]  # -2 is correct?????
+        self.nodes += 1
+        if (self.deadline is not None and self.nodes % TIME_CHECK_NODES == 0
+                and self.out_of_time()):
+            raise SearchTimeout()
         utility = terminal_state(state)
         if utility is not None:  # Game has a winner
-            return utility, action_values
-        avail_actions = available_actions(state)
+            self.terminal_nodes += 1
+            return utility
+        avail_actions = state.available_actions()
         if len(avail_actions) == 0:  # game is tie
-            return 0, action_values
+            self.terminal_nodes += 1
+            return 0
 
         if depth == 0:
-            return self.evaluation_function(state), action_values
-
+            return self.leaf_value(state)
+        if self.threats:
+            winning, avail_actions = state.threat_moves(1)
+            if winning is not None or not avail_actions:
+                self.terminal_nodes += 1  # decided one move ahead
+                return WIN_SCORE if winning is not None else -WIN_SCORE
+        if depth == 1 and self.batch_leaves:
+            return self.batch_frontier_value(state, 1, avail_actions)
+
+        key, mirrored = self.cache_key(state)
+        entry = self.probe(self.tt, key, mirrored, state)
+        hash_move = None
+        if entry is not None:
+            value, entry_depth, flag, hash_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        window = (alpha, beta)
+
+        ply = self.root_depth - depth
         v = -float('inf')
-        for a in avail_actions:
-            state_ = update_board(state.copy(), a, player_num=1)  # next state
-            v = max(v, self.min_value(state_, alpha, beta, depth-1))
-            action_values[a] = v
-            if v >= beta: return v, action_values
+        best_action = None
+        for i, a in enumerate(self.move_ordering.order(state, avail_actions, ply, hash_move)):
+            state.play(a, player_num=1)  # next state
+            if i > 0 and self.search == 'pvs':
+                mnv = self.min_value(state, alpha, alpha + 1, depth-1)
+                if alpha < mnv < beta:  # better than the first move, find out by how much
+                    mnv = self.min_value(state, alpha, beta, depth-1)
+            else:
+                mnv = self.min_value(state, alpha, beta, depth-1)
+            state.undo()
+            if mnv > v:
+                v, best_action = mnv, a
+            if v >= beta:
+                self.record_cutoff(state, a, 1, ply, depth, i)
+                break
             alpha = max(alpha, v)
-        return v, action_values
+        self.store(self.tt, key, mirrored, state, v, depth, bound_flag(v, *window), best_action)
+        return v
 
     def min_value(self, state, alpha, beta, depth):
         """min value calculation for alpha-beta Minimax algorithm"""
+        self.nodes += 1
+        if (self.deadline is not None and self.nodes % TIME_CHECK_NODES == 0
+                and self.out_of_time()):
+            raise SearchTimeout()
         utility = terminal_state(state)
         if utility is not None:  # Game has a winner
+            self.terminal_nodes += 1
             return utility
-        avail_actions = available_actions(state)
+        avail_actions = state.available_actions()
         if len(avail_actions) == 0:  # game is tie
+            self.terminal_nodes += 1
             return 0
 
         if depth == 0:
-            return -self.evaluation_function(state)
-
+            return self.leaf_value(state)
+        if self.threats:
+            winning, avail_actions = state.threat_moves(2)
+            if winning is not None or not avail_actions:
+                self.terminal_nodes += 1  # decided one move ahead
+                return -WIN_SCORE if winning is not None else WIN_SCORE
+        if depth == 1 and self.batch_leaves:
+            return self.batch_frontier_value(state, 2, avail_actions)
+
+        key, mirrored = self.cache_key(state)
+        entry = self.probe(self.tt, key, mirrored, state)
+        hash_move = None
+        if entry is not None:
+            value, entry_depth, flag, hash_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        window = (alpha, beta)
+
+        ply = self.root_depth - depth
         v = +float('inf')
-        for a in avail_actions:
-            state_ = update_board(state.copy(), a, player_num=2)  # next state
-            mxv, _ = self.max_value(state_, alpha, beta, depth-1)
-            v = min(v, mxv)
-            if v <= alpha: return v
+        best_action = None
+        for i, a in enumerate(self.move_ordering.order(state, avail_actions, ply, hash_move)):
+            state.play(a, player_num=2)  # next state
+            if i > 0 and self.search == 'pvs':
+                mxv = self.max_value(state, beta - 1, beta, depth-1)
+                if alpha < mxv < beta:  # better than the first move, find out by how much
+                    mxv = self.max_value(state, alpha, beta, depth-1)
+            else:
+                mxv = self.max_value(state, alpha, beta, depth-1)
+            state.undo()
+            if mxv < v:
+                v, best_action = mxv, a
+            if v <= alpha:
+                self.record_cutoff(state, a, 2, ply, depth, i)
+                break
             beta = min(beta, v)
+        self.store(self.tt, key, mirrored, state, v, depth, bound_flag(v, *window), best_action)
         return v
 
+    def count_cutoff(self, move_index, n=1):
+        """Count n cutoffs caused by the move tried move_index-th at a node"""
+        self.cutoffs += n
+        if move_index == 0:
+            self.first_move_cutoffs += n
+        while len(self.cutoffs_by_index) <= move_index:
+            self.cutoffs_by_index.append(0)
+        self.cutoffs_by_index[move_index] += n
+
+    def record_cutoff(self, state, move, player_num, ply, depth, move_index):
+        self.count_cutoff(move_index)
+        self.move_ordering.record_cutoff(state, move, player_num, ply, depth)
 
-    def get_alpha_beta_move(self, board):
+    def root_values(self, state, depth, pv_move=None, alpha=-float('inf'), beta=float('inf')):
+        """
+        Search every move of the player to move at the root and return the
+        best move and the values of all moves. The root is never cut off by
+        the transposition table so all moves get a value. Player 1
+        maximizes, player 2 minimizes. pv_move, the best move of the
+        previous iteration, is searched first. With a window narrower than
+        (-inf, inf) the search stops at the first move that fails high.
+        """
+        action_values = [None for _ in range(state.cols)]
+        player_num = state.to_move()
+        sign = 1 if player_num == 1 else -1
+        self.root_depth = depth
+        best_action, best_value = None, -float('inf')
+        actions = self.root_actions(state)
+        if pv_move is not None and pv_move not in actions:
+            pv_move = state.mirror_col(pv_move)
+        for i, a in enumerate(self.move_ordering.order(state, actions, 0, pv_move)):
+            state.play(a, player_num)
+            pvs = i > 0 and self.search == 'pvs'
+            if player_num == 1:
+                v = self.min_value(state, alpha, alpha + 1, depth-1) if pvs else None
+                if v is None or alpha < v < beta:
+                    v = self.min_value(state, alpha, beta, depth-1)
+                alpha = max(alpha, v)
+            else:
+                v = self.max_value(state, beta - 1, beta, depth-1) if pvs else None
+                if v is None or alpha < v < beta:
+                    v = self.max_value(state, alpha, beta, depth-1)
+                beta = min(beta, v)
+            state.undo()
+            action_values[a] = v
+            # later moves that fail low only return a bound, keep the first best
+            if sign * v > best_value:
+                best_action, best_value = a, sign * v
+            if alpha >= beta:
+                break  # failed high on an aspiration window
+        return best_action, self.mirror_values(state, action_values)
+
+    def aspiration_root_values(self, state, depth, pv_move, guess):
+        """
+        root_values with a window of self.aspiration around guess, the value
+        of the previous iteration; the side of the window the result falls
+        out of is opened and the root searched again
+        """
+        if self.aspiration is None or guess is None or abs(guess) >= WIN_SCORE:
+            return self.root_values(state, depth, pv_move)
+        alpha, beta = guess - self.aspiration, guess + self.aspiration
+        while True:
+            best_action, action_values = self.root_values(state, depth, pv_move, alpha, beta)
+            v = action_values[best_action]
+            if v <= alpha:
+                alpha = -float('inf')
+            elif v >= beta:
+                beta = float('inf')
+            else:
+                return best_action, action_values
+            pv_move = best_action
+
+    def get_alpha_beta_move(self, board, return_stats=False):
         """
         Given the current state of the board, return the next move based on
         the alpha-beta pruning algorithm
@@ -146,79 +602,271 @@ class AIPlayer:
                 - spaces that are occupied by player 2 have a 2 in them
 
         RETURNS:
-        The 0 based index of the column that represents the next move
+        The 0 based index of the column that represents the next move, and
+        its SearchStats if return_stats is set
         """
-
-        avail_actions = available_actions(board)
-        # heuristic depth value -  a logarithmic function of # available actions
-        n = len(avail_actions)
-        if n == 6:
-            d = 4
-        elif n == 5:
-            d = 5
-        elif n == 4:
-            d = 6
-        elif n == 3:
-            d = 8
-        elif n == 2:
-            d = 13
-        else:
-            d = 1
-        '''Calculate action values using depth-limited heuristic-based minimax algorithm'''
-        _, action_values = self.max_value(board, alpha=-float('inf'), beta=float('inf'), depth=d)
-        
-        '''Select best action from available actions based on action values returned from minimax'''
+        start = time.time()
+        self.reset_counters()
+        move, source = self.alpha_beta_search(board)
+        stats = self.search_stats('alpha_beta', source, move, start)
+        return (move, stats) if return_stats else move
+
+    def alpha_beta_search(self, board):
+        """Move for board from the book, the solver or the search, and which one it came from"""
+        if self.book is not None:
+            move = self.book.lookup(board, self.connect)
+            if move is not None and 0 in board[:, move]:
+                self.report_progress('book', move, None, 0, [move])
+                return move, 'book'
+
+        # one deadline for the whole move, the solver and the search share it
+        start = time.time()
+        deadline = self.deadline_for(start)
+        self.solution = None
+        empties = int((board == 0).sum())
+        if self.solver_empties is not None and empties <= self.solver_empties:
+            # the solver gets half the time, the rest is left for the search if it fails
+            solver_deadline = None if deadline is None else start + (deadline - start) / 2
+            move = self.solve_move(board, solver_deadline)
+            if move is not None:
+                self.report_progress('solver', move, self.root_value, self.depth_reached, [move])
+                return move, 'solver'
+
+        if self.workers > 1:
+            move = parallel_root_search(self, board, self.workers, deadline)
+            self.report_progress('parallel', move, self.root_value, self.depth_reached, [move])
+            return move, 'parallel'
+
+        state = self.search_state(board)
+        avail_actions = state.available_actions()
+        sign = 1 if state.to_move() == 1 else -1
+        max_depth = state.rows * state.cols - state.move_count
+        if self.max_depth is not None:
+            max_depth = min(max_depth, self.max_depth)
+
+        '''Iterative deepening: the move of the last completed iteration is played'''
         best_action = avail_actions[0]
-        best_value = -float('inf')
-        for i in avail_actions:
-            if action_values[i] > best_value:
-                best_action = i
-                best_value = action_values[i]
-        return best_action
-
-    '''max value calculation for Expectimax algorithm'''
-    def max_value_exp(self, state, depth):
+        values = []  # value of the best move of every completed iteration
+        self.move_ordering.new_search()
+        last_iteration = 0.0
+        for d in range(1, max_depth + 1):
+            iteration_start = time.time()
+            if deadline is not None and iteration_start + last_iteration > deadline:
+                break  # the next iteration costs at least as much as the last
+            if d > 1 and self.cancelled():
+                break
+            # depth 1 always completes so there is a move to return, the
+            # others stop at the deadline or when cancelled
+            self.deadline = (deadline if deadline is not None else float('inf')) if d > 1 else None
+            nodes_before = self.nodes
+            try:
+                # the guess comes from the last iteration of the same parity,
+                # the evaluation swings between odd and even depths
+                guess = values[-2] if len(values) >= 2 else None
+                best_action, action_values = self.aspiration_root_values(
+                    state, d, best_action, guess)
+            except SearchTimeout:
+                break
+            finally:
+                self.deadline = None
+            values.append(action_values[best_action])
+            self.root_value = values[-1]
+            best_value = sign * values[-1]
+            self.iteration_nodes.append(self.nodes - nodes_before)
+            self.depth_reached = d
+            last_iteration = time.time() - iteration_start
+            self.iteration_times.append(last_iteration)
+            self.report_progress('search', best_action, self.root_value, d,
+                                 self.principal_variation(state, best_action, d))
+            if best_value >= WIN_SCORE or best_value <= -WIN_SCORE:
+                break  # the game result is already decided
+        return best_action, 'search'
+
+    def bounded_leaf_value(self, state):
+        """Leaf value for expectimax, from the AI's side and kept inside the win scores"""
+        v = self.exp_sign * self.leaf_value(state)
+        return max(-EVAL_BOUND, min(EVAL_BOUND, v))
+
+    def exp_cache_key(self, state):
+        key, mirrored = self.cache_key(state)
+        return key ^ self.exp_salt, mirrored
+
+    def probe_exp_cache(self, state, alpha, beta, depth):
+        """
+        Look the node up in the expectimax cache. Returns (value, alpha, beta,
+        hash_move); value is not None when the cached entry settles the node.
+        """
+        entry = self.probe(self.exp_tt, *self.exp_cache_key(state), state)
+        if entry is None:
+            return None, alpha, beta, None
+        value, entry_depth, flag, hash_move = entry
+        if entry_depth >= depth:
+            if flag == EXACT:
+                return value, alpha, beta, hash_move
+            elif flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, alpha, beta, hash_move
+        return None, alpha, beta, hash_move
+
+    '''max value calculation for Expectimax algorithm, the AI player to move'''
+    def max_value_exp(self, state, alpha, beta, depth):
+        self.nodes += 1
+        if (self.deadline is not None and self.nodes % TIME_CHECK_NODES == 0
+                and self.out_of_time()):
+            raise SearchTimeout()
 
-        action_values = [0 for _ in range(state.shape[1])]
         utility = terminal_state(state)
         if utility is not None:  # Game has a winner
-            return utility, action_values
-        avail_actions = available_actions(state)
+            self.terminal_nodes += 1
+            return self.exp_sign * utility
+        avail_actions = state.available_actions()
         if len(avail_actions) == 0:  # game is tie
-            return 0.0, action_values
+            self.terminal_nodes += 1
+            return 0.0
 
         if depth == 0:
-            return self.evaluation_function(state), action_values
+            return self.bounded_leaf_value(state)
+
+        cached, alpha, beta, hash_move = self.probe_exp_cache(state, alpha, beta, depth)
+        if cached is not None:
+            return cached
+        window = (alpha, beta)
 
         v = -float('inf')
-        for a in avail_actions:
-            state_ = update_board(state.copy(), a, player_num=1)  # next state
-            v = max(v, self.exp_value(state_, depth-1))
-            action_values[a] = v
-        return v, action_values
+        best_action = None
+        for i, a in enumerate(self.exp_order(state, avail_actions, hash_move)):
+            state.play(a, player_num=self.exp_player)  # next state
+            ev = self.exp_value(state, alpha, beta, depth-1)
+            state.undo()
+            if ev > v:
+                v, best_action = ev, a
+            if v >= beta:
+                self.count_cutoff(i)
+                break
+            alpha = max(alpha, v)
+        key, mirrored = self.exp_cache_key(state)
+        self.store(self.exp_tt, key, mirrored, state, v, depth, bound_flag(v, *window), best_action)
+        return v
 
-    '''expectation value calculation for Expectimax algorithm'''
-    def exp_value(self, state, depth):
+    def probe_max_exp(self, state, depth):
+        """
+        Lower bound of a max node: the value of its first move only, used by
+        the Star2 probing of chance nodes
+        """
+        utility = terminal_state(state)
+        if utility is not None:
+            return self.exp_sign * utility
+        avail_actions = state.available_actions()
+        if len(avail_actions) == 0:
+            return 0.0
+        if depth == 0:
+            return self.bounded_leaf_value(state)
+        entry = self.probe(self.exp_tt, *self.exp_cache_key(state), state)
+        hash_move = entry[3] if entry is not None else None
+        if entry is not None and entry[1] >= depth and entry[2] != UPPER:
+            return entry[0]  # exact value or lower bound already known at this depth
+        a = self.exp_order(state, avail_actions, hash_move)[0]
+        state.play(a, player_num=self.exp_player)
+        v = self.exp_value(state, -float('inf'), float('inf'), depth-1)
+        state.undo()
+        return v
+
+    '''expectation value calculation for Expectimax algorithm, the random player to move'''
+    def exp_value(self, state, alpha, beta, depth):
+        self.nodes += 1
+        if (self.deadline is not None and self.nodes % TIME_CHECK_NODES == 0
+                and self.out_of_time()):
+            raise SearchTimeout()
 
         utility = terminal_state(state)
         if utility is not None:  # Game has a winner
-            return utility
-        avail_actions = available_actions(state)
+            self.terminal_nodes += 1
+            return self.exp_sign * utility
+        avail_actions = state.available_actions()
         if len(avail_actions) == 0:  # game is tie
+            self.terminal_nodes += 1
             return 0.0
 
         if depth == 0:
-            return self.evaluation_function(state)
-
-        v = 0.0
-        for a in avail_actions:
-            state_ = update_board(state.copy(), a, player_num=1)  # next state
-            p = 1 / len(available_actions(state_))
-            mxv, _ = self.max_value_exp(state_, depth - 1)
-            v += p*max(v, mxv)
+            return self.bounded_leaf_value(state)
+
+        cached, alpha, beta, _ = self.probe_exp_cache(state, alpha, beta, depth)
+        if cached is not None:
+            return cached
+        window = (alpha, beta)
+        key, _ = self.exp_cache_key(state)  # chance nodes store no move
+        opponent = 3 - self.exp_player
+
+        # every move of the random player is equally likely
+        n = len(avail_actions)
+        lower = [-WIN_SCORE for _ in range(n)]  # lower bounds of the children values
+        if self.star2 and depth > 1:
+            for i, a in enumerate(avail_actions):
+                state.play(a, player_num=opponent)
+                lower[i] = self.probe_max_exp(state, depth-1)
+                state.undo()
+            if sum(lower) / n >= beta:
+                v = sum(lower) / n
+                self.exp_tt.store(key, v, depth, LOWER)
+                return v
+
+        # Star1: stop as soon as the children left cannot bring the average
+        # back inside the window, whatever their (bounded) values are
+        total = 0.0
+        lower_left = sum(lower)
+        for i, a in enumerate(avail_actions):
+            lower_left -= lower[i]
+            upper_left = WIN_SCORE * (n - i - 1)
+            child_alpha = n * alpha - total - upper_left
+            child_beta = n * beta - total - lower_left
+            state.play(a, player_num=opponent)  # next state
+            mxv = self.max_value_exp(state, child_alpha, child_beta, depth-1)
+            state.undo()
+            if mxv >= child_beta:
+                v = (total + mxv + lower_left) / n
+                self.exp_tt.store(key, v, depth, LOWER)
+                return v
+            if mxv <= child_alpha:
+                v = (total + mxv + upper_left) / n
+                self.exp_tt.store(key, v, depth, UPPER)
+                return v
+            total += mxv
+        v = total / n
+        self.exp_tt.store(key, v, depth, bound_flag(v, *window))
         return v
 
-    def get_expectimax_move(self, board):
+    def exp_order(self, state, actions, hash_move=None):
+        """Cached best move first, then the columns from the center out"""
+        rank = self.move_ordering_rank(state.cols)
+        return sorted(actions, key=lambda a: (a != hash_move, rank[a]))
+
+    def move_ordering_rank(self, cols):
+        if cols not in self.center_rank:
+            self.center_rank[cols] = {c: r for r, c in enumerate(center_order(cols))}
+        return self.center_rank[cols]
+
+    def exp_root_values(self, state, depth, pv_move=None):
+        """Best move and values of all the AI's moves at the expectimax root"""
+        action_values = [None for _ in range(state.cols)]
+        alpha = -float('inf')
+        best_action, best_value = None, -float('inf')
+        actions = self.root_actions(state)
+        if pv_move is not None and pv_move not in actions:
+            pv_move = state.mirror_col(pv_move)
+        for a in self.exp_order(state, actions, pv_move):
+            state.play(a, player_num=self.exp_player)
+            v = self.exp_value(state, alpha, float('inf'), depth-1)
+            state.undo()
+            action_values[a] = v
+            if v > best_value:
+                best_action, best_value = a, v
+            alpha = max(alpha, v)
+        return best_action, self.mirror_values(state, action_values)
+
+    def get_expectimax_move(self, board, return_stats=False):
         """
         Given the current state of the board, return the next move based on
         the expectimax algorithm.
@@ -237,34 +885,56 @@ class AIPlayer:
                 - spaces that are occupied by player 2 have a 2 in them
 
         RETURNS:
-        The 0 based index of the column that represents the next move
+        The 0 based index of the column that represents the next move, and
+        its SearchStats if return_stats is set
         """
-
-        avail_actions = available_actions(board)
-        # heuristic depth value -  a logarithmic function of # available actions
-        n = len(avail_actions)
-        if n == 6:
-            d = 4
-        elif n == 5:
-            d = 5
-        elif n == 4:
-            d = 6
-        elif n == 3:
-            d = 8
-        elif n == 2:
-            d = 13
-        else:
-            d = 1
-        '''Calculate action values using depth-limited heuristic-based minimax algorithm'''
-        _, action_values = self.max_value_exp(board, depth=d)
-
-        '''Select best action from available actions based on action values returned from minimax'''
+        start = time.time()
+        self.reset_counters()
+        move = self.expectimax_search(board, start)
+        stats = self.search_stats('expectimax', 'search', move, start)
+        return (move, stats) if return_stats else move
+
+    def expectimax_search(self, board, start):
+        """Iterative deepening expectimax on board, started at start"""
+        state = self.search_state(board)
+        avail_actions = state.available_actions()
+        self.exp_player = state.to_move()
+        self.exp_sign = 1 if self.exp_player == 1 else -1
+        # values are from the AI's side, keep the two sides apart in the cache
+        self.exp_salt = 0 if self.exp_player == 1 else EXP_SIDE_SALT
+        max_depth = state.rows * state.cols - state.move_count
+        if self.max_depth is not None:
+            max_depth = min(max_depth, self.max_depth)
+        deadline = self.deadline_for(start)
+
+        '''Iterative deepening: the move of the last completed iteration is played'''
         best_action = avail_actions[0]
-        best_value = -float('inf')
-        for i in avail_actions:
-            if action_values[i] > best_value:
-                best_action = i
-                best_value = action_values[i]
+        last_iteration = 0.0
+        for d in range(1, max_depth + 1):
+            iteration_start = time.time()
+            if deadline is not None and iteration_start + last_iteration > deadline:
+                break  # the next iteration costs at least as much as the last
+            if d > 1 and self.cancelled():
+                break
+            # depth 1 always completes so there is a move to return, the
+            # others stop at the deadline or when cancelled
+            self.deadline = (deadline if deadline is not None else float('inf')) if d > 1 else None
+            nodes_before = self.nodes
+            try:
+                best_action, action_values = self.exp_root_values(state, d, best_action)
+            except SearchTimeout:
+                break
+            finally:
+                self.deadline = None
+            self.iteration_nodes.append(self.nodes - nodes_before)
+            self.depth_reached = d
+            self.root_value = self.exp_sign * action_values[best_action]
+            last_iteration = time.time() - iteration_start
+            self.iteration_times.append(last_iteration)
+            # the table of the AI's moves holds no line of play through the random replies
+            self.report_progress('search', best_action, self.root_value, d, [best_action])
+            if action_values[best_action] >= WIN_SCORE:
+                break  # a win is forced whatever the random player does
         return best_action
 
     def evaluation_function(self, board):
@@ -285,6 +955,9 @@ class AIPlayer:
         RETURNS:
         The utility value for the current board
         """
+        if self.evaluation == 'window':
+            return self.window_evaluator(*board.shape).evaluate(board)
+
         """kernel_score rewards all vertical, horizontal, and diagonal winning situations"""
         r_score = self.kernel_score(board)
         c_score = self.kernel_score(board.T)
@@ -293,33 +966,35 @@ class AIPlayer:
     def kernel_score(self, board):
         """creating kernels that consider all vertical, horizontal, and diagonal win situations"""
         """adding zeros in between rewards the diagonal winning situations"""
-        good_kernels = ['11', '101', '111', '1101', '1011']
-        good_weights = [ 1,    1,     100,   100,    100]
-        bad_kernels = ['22', '21112', '2112', '202', '222', '2202', '2022']
-        bad_weights = [ 1,    1,       1,      100,   100,   100,    100]
+        good_kernels = GOOD_KERNELS
+        good_weights = self.weights[:len(GOOD_KERNELS)]
+        bad_kernels = BAD_KERNELS
+        bad_weights = self.weights[len(GOOD_KERNELS):]
         to_str = lambda a: ''.join(a.astype(str))
 
         max_kernel_count = 0
         min_kernel_count = 0
         for row in board:
+            row_str = to_str(row)
             ''' Count the max player streaks'''
             for k, w in zip(good_kernels, good_weights):
-                if k in to_str(row):
+                if k in row_str:
                     max_kernel_count += w
 
             ''' Count the min player streaks'''
             for k, w in zip(bad_kernels, bad_weights):
-                if k in to_str(row):
+                if k in row_str:
                     min_kernel_count += w
 
         return max_kernel_count - min_kernel_count
 
 
 class RandomPlayer:
-    def __init__(self, player_number):
+    def __init__(self, player_number, seed=None):
         self.player_number = player_number
         self.type = 'random'
         self.player_string = 'Player {}:random'.format(player_number)
+        self.rng = np.random.RandomState(seed)  # seed for reproducible games
 
     def get_move(self, board):
         """
@@ -339,12 +1014,7 @@ class RandomPlayer:
         RETURNS:
         The 0 based index of the column that represents the next move
         """
-        valid_cols = []
-        for col in range(board.shape[1]):
-            if 0 in board[:, col]:
-                valid_cols.append(col)
-
-        return np.random.choice(valid_cols)
+        return self.rng.choice(available_actions(board))
 
 
 class HumanPlayer:
@@ -371,10 +1041,7 @@ class HumanPlayer:
         The 0 based index of the column that represents the next move
         """
 
-        valid_cols = []
-        for i, col in enumerate(board.T):
-            if 0 in col:
-                valid_cols.append(i)
+        valid_cols = available_actions(board)
 
         move = int(input('Enter your move: '))
 
@@ -0,0 +1,74 @@
+import numpy as np
+
+from Bitboard import CONNECT, mask_has_won, player_mask
+
+"""
+Connect 4 rules on the numpy board used by the GUI, the players and the
+headless runners. The board can have any size, its shape gives the number
+of rows and columns; connect, the discs in a line needed to win, is 4
+unless given:
+    - row 0 is the top of the board and so is the last row filled
+    - spaces that are unoccupied are marked as 0
+    - spaces that are occupied by player 1 have a 1 in them
+    - spaces that are occupied by player 2 have a 2 in them
+
+The AI search works on Bitboard, which implements the same rules on bit masks.
+"""
+
+
+def legal_moves_mask(board):
+    """Boolean array, True for the columns that still have room"""
+    return board[0] == 0
+
+
+def available_actions(board):
+    """ Given the current game state returns the valid columns """
+    return np.flatnonzero(legal_moves_mask(board)).tolist()
+
+
+def drop_row(board, move):
+    """Row the next disc dropped in column move lands on, None if the column is full"""
+    if board[0, move] != 0:
+        return None
+    return board.shape[0] - 1 - int(np.count_nonzero(board[:, move]))
+
+
+def update_board(board, move, player_num):
+    """drop a disc of player_num in column move, in place"""
+    row = drop_row(board, move)
+    if row is None:
+        err = 'Invalid move by player {}. Column {}'.format(player_num, move)
+        raise Exception(err)
+    board[row, move] = player_num
+    return board
+
+
+def game_completed(board, player_num, connect=CONNECT):
+    """check if the player has won the game"""
+    return mask_has_won(player_mask(board, player_num), board.shape[0] + 1, connect)
+
+
+def line_completed(board, row, col, connect=CONNECT):
+    """check if the disc at (row, col) is part of a line of connect discs"""
+    player_num = board[row, col]
+    rows, cols = board.shape
+    for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        count = 1
+        for sign in [1, -1]:
+            r, c = row + sign * dr, col + sign * dc
+            while 0 <= r < rows and 0 <= c < cols and board[r, c] == player_num:
+                count += 1
+                r, c = r + sign * dr, c + sign * dc
+        if count >= connect:
+            return True
+    return False
+
+
+def is_full(board):
+    return not legal_moves_mask(board).any()
+
+
+def is_draw(board, connect=CONNECT):
+    """check if the board is full without a winner"""
+    return (is_full(board) and not game_completed(board, 1, connect)
+            and not game_completed(board, 2, connect))
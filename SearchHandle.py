@@ -0,0 +1,78 @@
+import threading
+
+"""
+Anytime search: an AIPlayer search running in a background thread that can
+be polled for the best move found so far and stopped at any time, e.g.
+
+    handle = player.start_search(board)
+    ...
+    handle.poll()        # {'move', 'value', 'depth', 'pv', 'source', 'nodes', 'done'}
+    move = handle.stop() # cancel and take the best move so far
+
+The best move so far is the move of the last completed iteration of the
+iterative deepening, with its value for player 1 and the principal
+variation read from the transposition table (AIPlayer.report_progress).
+"""
+
+
+class SearchHandle:
+    def __init__(self, player, board, method='get_alpha_beta_move'):
+        self.player = player
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.progress = None
+        self.move = None
+        self.stats = None
+        self.error = None
+        player.cancel_event = self.cancel_event
+        player.on_progress = self.update
+        self.thread = threading.Thread(target=self.run, args=(board.copy(), method), daemon=True)
+        self.thread.start()
+
+    def run(self, board, method):
+        try:
+            self.move, self.stats = getattr(self.player, method)(board, return_stats=True)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.player.cancel_event = None
+            self.player.on_progress = None
+            self.finished.set()
+
+    def update(self, progress):
+        with self.lock:
+            self.progress = dict(progress)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def poll(self):
+        """Best move so far as a dict, None before the first iteration completes"""
+        with self.lock:
+            if self.progress is None:
+                return None
+            return dict(self.progress, done=self.done())
+
+    def cancel(self):
+        """Ask the search to stop; it does at its next look at the clock"""
+        self.cancel_event.set()
+
+    def result(self, timeout=None):
+        """
+        Move of the finished search, waiting up to timeout seconds for it;
+        the best move so far if it is still running by then
+        """
+        if self.finished.wait(timeout):
+            if self.error is not None:
+                raise self.error
+            return self.move
+        progress = self.poll()
+        if progress is None:
+            raise Exception('Player {} has no move yet'.format(self.player.player_number))
+        return progress['move']
+
+    def stop(self, timeout=1.0):
+        """Cancel the search and return the best move so far"""
+        self.cancel()
+        return self.result(timeout)
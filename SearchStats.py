@@ -0,0 +1,71 @@
+import json
+
+"""
+Statistics of the search behind one AI move, returned alongside the move by
+AIPlayer.get_alpha_beta_move / get_expectimax_move with return_stats=True and
+kept in AIPlayer.last_stats. One JSON object per move, so a game or a match
+can be logged as JSON lines:
+
+    move, stats = player.get_alpha_beta_move(board, return_stats=True)
+    stats.append('stats.jsonl')
+"""
+
+
+class SearchStats:
+    def __init__(self, method, player_number):
+        self.method = method  # 'alpha_beta' or 'expectimax'
+        self.player_number = player_number
+        self.source = 'search'  # 'book', 'solver', 'search' or 'parallel'
+        self.move = None
+        self.elapsed = 0.0  # seconds for the whole move
+        self.nodes = 0
+        self.terminal_nodes = 0  # won or full positions
+        self.leaf_nodes = 0  # positions scored by the evaluation at the depth limit
+        self.cutoffs_by_index = []  # cutoffs caused by the i-th move tried at a node
+        self.tt_hits = 0
+        self.tt_probes = 0
+        self.depth_reached = 0
+        self.value = None  # value of the move for player 1, None for book moves
+        self.iterations = []  # (depth, nodes, seconds) of every completed iteration
+
+    @property
+    def cutoffs(self):
+        return sum(self.cutoffs_by_index)
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'method': self.method,
+            'player': self.player_number,
+            'source': self.source,
+            'move': self.move,
+            'elapsed': self.elapsed,
+            'nodes': self.nodes,
+            'nodes_per_second': self.nodes_per_second,
+            'terminal_nodes': self.terminal_nodes,
+            'leaf_nodes': self.leaf_nodes,
+            'cutoffs': self.cutoffs,
+            'cutoffs_by_index': list(self.cutoffs_by_index),
+            'tt_hits': self.tt_hits,
+            'tt_probes': self.tt_probes,
+            'tt_hit_rate': self.tt_hit_rate,
+            'depth_reached': self.depth_reached,
+            'value': self.value,
+            'iterations': [{'depth': d, 'nodes': n, 'seconds': s}
+                           for d, n, s in self.iterations],
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+    def append(self, path):
+        """Add the stats as one line to the JSON lines file at path"""
+        with open(path, 'a') as f:
+            f.write(self.to_json() + '\n')
@@ -0,0 +1,230 @@
+# system libs
+import argparse
+import json
+import multiprocessing as mp
+import os
+import struct
+import sys
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Bitboard import CONNECT, Bitboard
+from Evaluation import WindowEvaluator, default_weights
+from MatchRunner import make_player
+from Rules import available_actions, game_completed, update_board
+
+"""
+Self-play positions for tuning and training evaluations. Games between
+AIPlayer and RandomPlayer are played over a pool of processes and every
+position before a move is streamed to a file of fixed-width records:
+
+    header  - MAGIC, then rows, cols, connect and the record size as uint32
+    records - RECORD per position, in the order the games finish
+
+Positions are the two bitboard masks of the Bitboard layout, so boards are
+limited to (rows + 1) * cols <= 64 like the opening book. Values and
+outcomes are for player 1, like the search values. The file is memory
+mapped by PositionFile, which yields the records as NumPy batches:
+
+    python SelfPlay.py positions.bin --games 10000 --depth 6 --processes 16
+
+    data = PositionFile('positions.bin')
+    for batch in data.batches(65536, shuffle=True):
+        boards = data.boards(batch)
+"""
+
+MAGIC = b'C4SELF01'
+HEADER = struct.Struct('<8sIIII')
+RECORD = np.dtype([
+    ('p1', '<u8'),  # player 1 discs
+    ('p2', '<u8'),  # player 2 discs
+    ('move', 'i1'),  # column played from the position
+    ('ply', 'u1'),  # discs on the board, player 1 is to move when even
+    ('outcome', 'i1'),  # 1 player 1 won the game, -1 player 2 won, 0 draw
+    ('source', 'u1'),  # index in SOURCES of who chose the move
+    ('value', '<f4'),  # search value of the move, NaN when it was not searched
+    ('game', '<u4'),
+])
+SOURCES = ['random', 'search', 'solver', 'book', 'parallel']
+DEFAULT_RANDOM_PLIES = 4  # random opening moves, otherwise AI vs AI games are all alike
+
+# AIPlayer objects of a process, kept between games so their tables are allocated once
+_players = {}
+
+
+def game_player(name, num, time_limit, max_depth, seed, connect):
+    if name != 'ai':
+        return make_player(name, num, time_limit, max_depth, seed, connect)
+    key = (num, time_limit, max_depth, connect)
+    if key not in _players:
+        _players[key] = make_player(name, num, time_limit, max_depth, seed, connect)
+    return _players[key]
+
+
+def play_game(task):
+    """
+    Play one game without a GUI and return the record of every position
+    before a move, as an array of RECORD
+    """
+    game, names, time_limit, max_depth, seed, random_plies, (rows, cols, connect) = task
+    players = [game_player(name, num, time_limit, max_depth, seed + num, connect)
+               for num, name in enumerate(names, start=1)]
+    opening = make_player('random', 1, None, None, seed)
+    board = np.zeros([rows, cols]).astype(np.uint8)
+    state = Bitboard(rows, cols, connect)
+    records = np.zeros(rows * cols, dtype=RECORD)
+    current_turn = 0
+    winner = 0
+    ply = 0
+
+    while available_actions(board):
+        current_player = players[current_turn]
+        record = records[ply]
+        record['p1'], record['p2'] = state.masks
+        record['ply'] = ply
+        record['value'] = np.nan
+        if ply < random_plies:
+            move = opening.get_move(board)
+            record['source'] = SOURCES.index('random')
+        elif current_player.type == 'ai':
+            if players[int(not current_turn)].type == 'random':
+                p_func = current_player.get_expectimax_move
+            else:
+                p_func = current_player.get_alpha_beta_move
+            move, stats = p_func(board, return_stats=True)
+            record['source'] = SOURCES.index(stats.source)
+            if stats.value is not None:
+                record['value'] = stats.value
+        else:
+            move = current_player.get_move(board)
+            record['source'] = SOURCES.index('random')
+        record['move'] = move
+
+        update_board(board, int(move), current_player.player_number)
+        state.play(int(move), current_player.player_number)
+        ply += 1
+        if game_completed(board, current_player.player_number, connect):
+            winner = current_player.player_number
+            break
+        current_turn = int(not current_turn)
+
+    records = records[:ply]
+    records['outcome'] = {0: 0, 1: 1, 2: -1}[winner]
+    records['game'] = game
+    return records
+
+
+def generate(path, games, player1='ai', player2='ai', processes=1, time_limit=None,
+             max_depth=6, seed=0, random_plies=DEFAULT_RANDOM_PLIES, rows=6, cols=7,
+             connect=CONNECT):
+    """
+    Play games between player1 and player2 ('ai' or 'random') over a pool of
+    processes, writing their positions to path as they finish. Returns a
+    summary dict.
+    """
+    if (rows + 1) * cols > 64:
+        raise Exception('A {}x{} board does not fit in 64-bit masks'.format(rows, cols))
+    geometry = (rows, cols, connect)
+    tasks = [(i, (player1, player2), time_limit, max_depth, seed + 3 * i, random_plies, geometry)
+             for i in range(games)]
+
+    start = time.time()
+    positions = 0
+    outcomes = {1: 0, -1: 0, 0: 0}
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, rows, cols, connect, RECORD.itemsize))
+        if processes > 1:
+            pool = mp.Pool(processes)
+            results = pool.imap_unordered(play_game, tasks)
+        else:
+            pool = None
+            results = map(play_game, tasks)
+        try:
+            for records in results:
+                f.write(records.tobytes())
+                positions += len(records)
+                outcomes[int(records['outcome'][0])] += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+    elapsed = time.time() - start
+    return {'games': games, 'positions': positions, 'bytes': os.path.getsize(path),
+            'elapsed_seconds': elapsed, 'positions_per_second': positions / elapsed,
+            'outcomes': {'player1': outcomes[1], 'player2': outcomes[-1], 'draws': outcomes[0]},
+            'players': [player1, player2], 'board': {'rows': rows, 'cols': cols,
+                                                     'connect': connect}}
+
+
+class PositionFile:
+    def __init__(self, path):
+        """Memory map a position file written by generate"""
+        with open(path, 'rb') as f:
+            magic, rows, cols, connect, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception('{} is not a position file'.format(path))
+        if record_size != RECORD.itemsize:
+            raise Exception('{} has {} byte records, expected {}'.format(
+                path, record_size, RECORD.itemsize))
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        # a game cut short by an interrupted writer leaves a partial record at the end
+        n = (os.path.getsize(path) - HEADER.size) // RECORD.itemsize
+        self.records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(n,))
+        self.evaluator = WindowEvaluator(rows, cols, default_weights(connect), connect)
+
+    def __len__(self):
+        return len(self.records)
+
+    def batches(self, batch_size=65536, shuffle=False, seed=0):
+        """
+        Records in arrays of batch_size. With shuffle the batches come in a
+        random order and are shuffled inside, which keeps the reads sequential
+        """
+        starts = np.arange(0, len(self.records), batch_size)
+        rng = np.random.RandomState(seed)
+        if shuffle:
+            rng.shuffle(starts)
+        for start in starts:
+            batch = self.records[start:start + batch_size]
+            yield batch[rng.permutation(len(batch))] if shuffle else batch
+
+    def boards(self, records):
+        """(N, rows, cols) numpy boards of an array of records"""
+        return self.evaluator.unpack_masks(records['p1'], records['p2'])
+
+
+if __name__ == '__main__':
+    player_types = ['ai', 'random']
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='Position file to write')
+    parser.add_argument('--player1', choices=player_types, default='ai')
+    parser.add_argument('--player2', choices=player_types, default='ai')
+    parser.add_argument('--games', type=int, default=1000,
+                        help='Number of games to play (int)')
+    parser.add_argument('--processes', type=int, default=mp.cpu_count(),
+                        help='Games played at the same time (int)')
+    parser.add_argument('--time', type=float, default=None,
+                        help='Time for an AI move in seconds, unlimited by default')
+    parser.add_argument('--depth', type=int, default=6,
+                        help='Maximum AI search depth (int)')
+    parser.add_argument('--random-plies', type=int, default=DEFAULT_RANDOM_PLIES,
+                        help='Random opening moves of every game (int)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random moves (int)')
+    parser.add_argument('--rows', type=int, default=6,
+                        help='Rows of the board (int)')
+    parser.add_argument('--cols', type=int, default=7,
+                        help='Columns of the board (int)')
+    parser.add_argument('--connect', type=int, default=CONNECT,
+                        help='Discs in a line needed to win (int)')
+    args = parser.parse_args()
+
+    summary = generate(args.path, args.games, args.player1, args.player2, args.processes,
+                       args.time, args.depth, args.seed, args.random_plies, args.rows,
+                       args.cols, args.connect)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
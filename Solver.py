@@ -0,0 +1,196 @@
+import time
+
+from Bitboard import CONNECT, winning_cells
+from MoveOrdering import center_order
+from TranspositionTable import DEFAULT_TT_BYTES, UPPER, TranspositionTable
+
+"""
+Exact solver for positions close to the end of the game: negamax with
+alpha-beta on bitboards, only trying moves that do not hand the opponent an
+immediate win, and a transposition table of upper bounds. The value of the
+root is found with null-window searches narrowing in on it (MTD(f) style).
+
+Positions are (current, mask): the discs of the player to move and all the
+discs. Scores follow the usual convention of Connect 4 solvers:
+
+    0   draw
+    >0  the player to move wins, the higher the score the sooner
+    <0  the player to move loses, the lower the score the sooner
+
+A win with the m-th disc of the game scores (size + 2 - m) // 2, size being
+the number of cells of the board, so a win with the next disc after moves
+discs scores (size + 1 - moves) // 2. Any board size and line length work.
+"""
+
+CHECK_NODES = 1024  # nodes between two looks at the clock
+
+
+class SolverTimeout(Exception):
+    """Raised when the solver runs past its deadline"""
+
+
+class Solver:
+    def __init__(self, rows=6, cols=7, tt_bytes=DEFAULT_TT_BYTES // 4, connect=CONNECT):
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.size = rows * cols
+        self.col_bits = rows + 1
+        self.bottom = sum(1 << (col * self.col_bits) for col in range(cols))
+        self.board_mask = self.bottom * ((1 << rows) - 1)
+        self.column_masks = [((1 << rows) - 1) << (col * self.col_bits) for col in range(cols)]
+        self.order = center_order(cols)
+        self.tt = TranspositionTable(max_bytes=tt_bytes)
+        self.nodes = 0
+        self.deadline = None
+        self.cancel_event = None  # an object with is_set(), stops the search like the deadline
+
+    def winning_cells(self, current, mask):
+        """Empty cells where the discs current would complete four in a row"""
+        return winning_cells(current, self.col_bits, self.connect) & (self.board_mask ^ mask)
+
+    def possible(self, mask):
+        """Cells where a disc can be dropped"""
+        return (mask + self.bottom) & self.board_mask
+
+    def can_win_next(self, current, mask):
+        return bool(self.winning_cells(current, mask) & self.possible(mask))
+
+    def non_losing_moves(self, current, mask):
+        """
+        Cells the player to move can play without the opponent winning right
+        after; 0 if every move loses
+        """
+        possible = self.possible(mask)
+        opponent_win = self.winning_cells(current ^ mask, mask)
+        forced = possible & opponent_win
+        if forced:
+            if forced & (forced - 1):
+                return 0  # two threats to block at once
+            possible = forced
+        # never play right below an opponent's winning cell
+        return possible & ~(opponent_win >> 1)
+
+    def negamax(self, current, mask, moves, alpha, beta):
+        """
+        Score of a position where the player to move cannot win immediately,
+        within the (alpha, beta) window
+        """
+        self.nodes += 1
+        if (self.deadline is not None and self.nodes % CHECK_NODES == 0
+                and (time.time() > self.deadline or
+                     (self.cancel_event is not None and self.cancel_event.is_set()))):
+            raise SolverTimeout()
+
+        next_moves = self.non_losing_moves(current, mask)
+        if next_moves == 0:
+            return -((self.size - moves) // 2)
+        if moves >= self.size - 2:
+            return 0  # neither player can win with their last disc
+
+        lower = -((self.size - 2 - moves) // 2)
+        if alpha < lower:
+            alpha = lower
+            if alpha >= beta:
+                return alpha
+        upper = (self.size - 1 - moves) // 2
+        key = current + mask + self.bottom
+        entry = self.tt.probe(key)
+        if entry is not None:
+            upper = entry[0]
+        if beta > upper:
+            beta = upper
+            if alpha >= beta:
+                return beta
+
+        # moves creating the most winning cells first, ties center first
+        ordered = []
+        for col in self.order:
+            move = next_moves & self.column_masks[col]
+            if move:
+                threats = bin(self.winning_cells(current | move, mask | move)).count('1')
+                ordered.append((-threats, len(ordered), move))
+        ordered.sort()
+
+        for _, _, move in ordered:
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        self.tt.store(key, alpha, 0, UPPER)
+        return alpha
+
+    def solve(self, current, mask, moves):
+        """Exact score of a position, narrowing in with null-window searches"""
+        if self.can_win_next(current, mask):
+            return (self.size + 1 - moves) // 2
+        lo = -((self.size - moves) // 2)
+        hi = (self.size + 1 - moves) // 2
+        while lo < hi:
+            med = lo + (hi - lo) // 2
+            # probe closer to zero first, most positions are near a draw
+            if med <= 0 and int(lo / 2) < med:
+                med = int(lo / 2)
+            elif med >= 0 and hi // 2 > med:
+                med = hi // 2
+            r = self.negamax(current, mask, moves, med, med + 1)
+            if r <= med:
+                hi = r
+            else:
+                lo = r
+        return lo
+
+    def position(self, state):
+        """(current, mask, moves) of a Bitboard"""
+        mask = state.masks[0] | state.masks[1]
+        current = state.masks[state.to_move() - 1]
+        return current, mask, state.move_count
+
+    def best_move(self, state, deadline=None, cancel_event=None):
+        """
+        Best column for the player to move on a Bitboard and its exact score.
+        Raises SolverTimeout if deadline passes or cancel_event is set first.
+        """
+        if deadline is None and cancel_event is not None:
+            deadline = float('inf')  # the clock checks also look at cancel_event
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.nodes = 0
+        try:
+            current, mask, moves = self.position(state)
+            possible = self.possible(mask)
+            wins = self.winning_cells(current, mask) & possible
+            playable = [col for col in self.order if possible & self.column_masks[col]]
+            for col in playable:
+                if wins & self.column_masks[col]:
+                    return col, (self.size + 1 - moves) // 2
+
+            score = self.solve(current, mask, moves)
+            candidates = self.non_losing_moves(current, mask)
+            for col in playable:
+                move = candidates & self.column_masks[col]
+                if not move:
+                    continue
+                # the move keeps the score if the opponent cannot do better than -score
+                r = self.negamax(current ^ mask, mask | move, moves + 1, -score, -score + 1)
+                if r <= -score:
+                    return col, score
+            return playable[0], score  # every move loses right away
+        finally:
+            self.deadline = None
+            self.cancel_event = None
+
+    def result(self, score, moves):
+        """
+        ('win' / 'loss' / 'draw', plies until the end) for the player to
+        move, score being the solved score after moves discs were played
+        """
+        if score == 0:
+            return 'draw', self.size - moves
+        # two discs m score (size + 2 - m) // 2, the winner's is the one
+        # played an odd number of plies from now for a win, even for a loss
+        end = self.size + 2 - 2 * abs(score)
+        if (end - moves) % 2 != (score > 0):
+            end -= 1
+        return ('win' if score > 0 else 'loss'), end - moves
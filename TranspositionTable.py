@@ -0,0 +1,99 @@
+"""
+Transposition table for the alpha-beta search, keyed by the Zobrist hash of
+a Bitboard.
+
+Every bucket has two slots: a depth-preferred slot that keeps the entry
+searched deepest, and an always-replace slot that takes whatever the
+depth-preferred slot refused. Entries are (value, depth, flag, best_move)
+tuples where flag tells whether value is exact or only a bound.
+"""
+
+EXACT = 0
+LOWER = 1  # search failed high, value is a lower bound
+UPPER = 2  # search failed low, value is an upper bound
+
+# rough footprint of one slot in CPython: key int, entry tuple, list pointers
+ENTRY_BYTES = 160
+
+DEFAULT_TT_BYTES = 64 * 2 ** 20
+
+
+def bound_flag(value, alpha, beta):
+    """Bound type of a fail-soft result searched with the window (alpha, beta)"""
+    if value <= alpha:
+        return UPPER
+    elif value >= beta:
+        return LOWER
+    return EXACT
+
+
+class TranspositionTable:
+    def __init__(self, max_bytes=DEFAULT_TT_BYTES):
+        # power of two number of buckets so the index is a mask of the key
+        n_buckets = 1
+        while 2 * n_buckets * 2 * ENTRY_BYTES <= max_bytes:
+            n_buckets *= 2
+        self.n_buckets = n_buckets
+        self.index_mask = n_buckets - 1
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        # slot 2*i is depth-preferred, slot 2*i + 1 is always-replace
+        self.keys = [None for _ in range(2 * self.n_buckets)]
+        self.entries = [None for _ in range(2 * self.n_buckets)]
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # misses on a bucket occupied by other positions
+        self.stores = 0
+
+    def probe(self, key):
+        """Return the (value, depth, flag, best_move) entry for key, or None"""
+        i = (key & self.index_mask) << 1
+        keys = self.keys
+        if keys[i] == key:
+            self.hits += 1
+            return self.entries[i]
+        if keys[i + 1] == key:
+            self.hits += 1
+            return self.entries[i + 1]
+        self.misses += 1
+        if keys[i] is not None or keys[i + 1] is not None:
+            self.collisions += 1
+        return None
+
+    def peek(self, key):
+        """probe without counting a hit or a miss, for looking at the table outside the search"""
+        i = (key & self.index_mask) << 1
+        if self.keys[i] == key:
+            return self.entries[i]
+        if self.keys[i + 1] == key:
+            return self.entries[i + 1]
+        return None
+
+    def store(self, key, value, depth, flag, best_move=None):
+        i = (key & self.index_mask) << 1
+        entry = self.entries[i]
+        if self.keys[i] == key or entry is None or depth >= entry[1]:
+            self.keys[i] = key
+            self.entries[i] = (value, depth, flag, best_move)
+        else:
+            self.keys[i + 1] = key
+            self.entries[i + 1] = (value, depth, flag, best_move)
+        self.stores += 1
+
+    def __len__(self):
+        return sum(1 for k in self.keys if k is not None)
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'entries': len(self),
+            'capacity': 2 * self.n_buckets,
+        }
@@ -0,0 +1,195 @@
+# system libs
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from Evaluation import KERNEL_WEIGHTS, default_weights, kernel_features, save_weights
+from SelfPlay import PositionFile
+
+"""
+Texel tuning of the evaluation weights on a self-play position file
+(SelfPlay.py). The evaluation of a position predicts the result of its game
+through a logistic curve,
+
+    P(player 1 wins) = 1 / (1 + exp(-k * evaluation))
+
+with draws counting as half a win. k is fitted first with the current
+weights, which fixes the scale of the evaluation, then the weights are
+fitted to minimize the log loss of the predictions. Both evaluations are
+linear in their weights (Evaluation.window_features / kernel_features), so
+the features are extracted once, by a pool of processes over chunks of the
+memory-mapped file, and the weights fitted by Newton's method on them.
+
+Every tenth game is held out to check the new weights on positions they
+were not fitted on. The weights are written as a JSON file for AIPlayer:
+
+    python Tuner.py positions.bin weights.json --evaluation window --processes 8
+    player = AIPlayer(1, weights='weights.json')
+"""
+
+CHUNK_POSITIONS = 65536  # positions per feature extraction task
+NEWTON_BLOCK = 1 << 20  # rows of the feature matrix converted to float at once
+HOLDOUT_GAMES = 10  # every HOLDOUT_GAMES-th game is kept for validation
+DEFAULT_MIN_PLY = 4  # the random opening moves of SelfPlay.py say little
+
+
+def default_evaluation_weights(evaluation, connect):
+    return KERNEL_WEIGHTS if evaluation == 'kernel' else default_weights(connect)
+
+
+def chunk_features(task):
+    """Features, results and holdout flags of the positions start:stop of a position file"""
+    path, start, stop, evaluation, min_ply = task
+    data = PositionFile(path)
+    records = np.asarray(data.records[start:stop])
+    records = records[records['ply'] >= min_ply]
+    boards = data.boards(records)
+    if evaluation == 'kernel':
+        features = kernel_features(boards)
+    else:
+        features = data.evaluator.window_features(boards)
+    results = (records['outcome'].astype(np.float32) + 1) / 2
+    holdout = records['game'] % HOLDOUT_GAMES == 0
+    return features.astype(np.int16), results, holdout
+
+
+def load_features(path, evaluation='window', processes=1, min_ply=DEFAULT_MIN_PLY):
+    """(features, results, holdout) of every position of the file, extracted in parallel"""
+    data = PositionFile(path)
+    if evaluation == 'kernel' and data.connect != 4:
+        raise ValueError('The kernel evaluation only plays connect 4')
+    tasks = [(path, start, start + CHUNK_POSITIONS, evaluation, min_ply)
+             for start in range(0, len(data), CHUNK_POSITIONS)]
+    if processes > 1:
+        with mp.Pool(processes) as pool:
+            chunks = pool.map(chunk_features, tasks)
+    else:
+        chunks = [chunk_features(task) for task in tasks]
+    if not chunks:
+        raise Exception('{} holds no positions'.format(path))
+    features, results, holdout = zip(*chunks)
+    return np.concatenate(features), np.concatenate(results), np.concatenate(holdout)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -500, 500)))
+
+
+def log_loss(features, results, weights, k):
+    """Mean log loss of the predicted results"""
+    total = 0.0
+    weights = np.asarray(weights, dtype=np.float64)
+    for start in range(0, len(features), NEWTON_BLOCK):
+        x = features[start:start + NEWTON_BLOCK].astype(np.float64) @ weights
+        y = results[start:start + NEWTON_BLOCK]
+        # log(1 + exp(-z)) for the wins and log(1 + exp(z)) for the losses, stable
+        z = k * x
+        total += (np.logaddexp(0, -z) * y + np.logaddexp(0, z) * (1 - y)).sum()
+    return total / len(features)
+
+
+def fit_k(features, results, weights, low=1e-6, high=1.0, iterations=60):
+    """Scale k of the logistic curve minimizing the loss with the given weights"""
+    # the loss is convex in k, golden section search on log k
+    a, b = np.log(low), np.log(high)
+    ratio = (np.sqrt(5) - 1) / 2
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc = log_loss(features, results, weights, np.exp(c))
+    fd = log_loss(features, results, weights, np.exp(d))
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = log_loss(features, results, weights, np.exp(c))
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = log_loss(features, results, weights, np.exp(d))
+    return float(np.exp((a + b) / 2))
+
+
+def fit_weights(features, results, weights, k, iterations=20, ridge=1e-6):
+    """
+    Weights minimizing the log loss at scale k by Newton's method, starting
+    from weights; ridge keeps the steps defined for features that never occur
+    """
+    w = np.asarray(weights, dtype=np.float64)
+    n = len(features)
+    for _ in range(iterations):
+        gradient = np.zeros(len(w))
+        hessian = np.zeros((len(w), len(w)))
+        for start in range(0, n, NEWTON_BLOCK):
+            x = features[start:start + NEWTON_BLOCK].astype(np.float64)
+            y = results[start:start + NEWTON_BLOCK]
+            p = sigmoid(k * (x @ w))
+            gradient += k * x.T @ (p - y)
+            hessian += k * k * (x.T * (p * (1 - p))) @ x
+        gradient /= n
+        hessian = hessian / n + ridge * np.eye(len(w))
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-3:
+            break
+    return w
+
+
+def tune(path, evaluation='window', processes=1, min_ply=DEFAULT_MIN_PLY, iterations=20):
+    """
+    Fit the weights of evaluation on the position file at path. Returns a
+    dict with the rounded weights and the losses before and after.
+    """
+    start = time.time()
+    connect = PositionFile(path).connect
+    features, results, holdout = load_features(path, evaluation, processes, min_ply)
+    extracted = time.time() - start
+    train_x, train_y = features[~holdout], results[~holdout]
+    test_x, test_y = features[holdout], results[holdout]
+
+    initial = default_evaluation_weights(evaluation, connect)
+    k = fit_k(train_x, train_y, initial)
+    fitted = fit_weights(train_x, train_y, initial, k, iterations)
+    # the evaluations add integer weights up, the scale of k keeps them large enough
+    weights = [int(w) for w in np.round(fitted)]
+    return {
+        'evaluation': evaluation,
+        'connect': connect,
+        'weights': weights,
+        'initial_weights': list(initial),
+        'k': k,
+        'positions': len(train_y),
+        'holdout_positions': len(test_y),
+        'train_loss': {'initial': log_loss(train_x, train_y, initial, k),
+                       'tuned': log_loss(train_x, train_y, weights, k)},
+        'holdout_loss': {'initial': log_loss(test_x, test_y, initial, k) if len(test_y) else None,
+                         'tuned': log_loss(test_x, test_y, weights, k) if len(test_y) else None},
+        'feature_seconds': extracted,
+        'elapsed_seconds': time.time() - start,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('positions', help='Position file written by SelfPlay.py')
+    parser.add_argument('output', help='Weight file to write (JSON)')
+    parser.add_argument('--evaluation', choices=['window', 'kernel'], default='window',
+                        help='Evaluation whose weights are tuned')
+    parser.add_argument('--processes', type=int, default=mp.cpu_count(),
+                        help='Processes extracting the features (int)')
+    parser.add_argument('--min-ply', type=int, default=DEFAULT_MIN_PLY,
+                        help='Skip positions with fewer discs (int)')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='Newton iterations (int)')
+    args = parser.parse_args()
+
+    report = tune(args.positions, args.evaluation, args.processes, args.min_ply,
+                  args.iterations)
+    info = {key: value for key, value in report.items() if key not in ('evaluation', 'weights')}
+    save_weights(args.output, report['evaluation'], report['weights'], **info)
+    json.dump(report, sys.stdout, indent=2)
+    print()
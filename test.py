@@ -1,65 +1,13 @@
 import numpy as np
 
+from Rules import available_actions, game_completed, update_board
+
 """ 
 Player 1: max player
 Player 2: min player
 """
 
 
-def update_board(board, move, player_num):
-    if 0 in board[:, move]:
-        update_row = -1
-        for row in range(1, board.shape[0]):
-            update_row = -1
-            if board[row, move] > 0 and board[row - 1, move] == 0:
-                update_row = row - 1
-            elif row == board.shape[0] - 1 and board[row, move] == 0:
-                update_row = row
-
-            if update_row >= 0:
-                board[update_row, move] = player_num
-                break
-    else:
-        err = 'Invalid move by player {}. Column {}'.format(player_num, move)
-        raise Exception(err)
-    return board
-
-
-def game_completed(board, player_num):
-    player_win_str = '{0}{0}{0}{0}'.format(player_num)
-    to_str = lambda a: ''.join(a.astype(str))
-
-    def check_horizontal(b):
-        for row in b:
-            if player_win_str in to_str(row):
-                return True
-        return False
-
-    def check_vertical(b):
-        return check_horizontal(b.T)
-
-    def check_diagonal(b):
-        for op in [None, np.fliplr]:
-            op_board = op(b) if op else b
-
-            root_diag = np.diagonal(op_board, offset=0).astype(np.int)
-            if player_win_str in to_str(root_diag):
-                return True
-
-            for i in range(1, b.shape[1] - 3):
-                for offset in [i, -i]:
-                    diag = np.diagonal(op_board, offset=offset)
-                    diag = to_str(diag.astype(np.int))
-                    if player_win_str in diag:
-                        return True
-
-        return False
-
-    return (check_horizontal(board) or
-            check_vertical(board) or
-            check_diagonal(board))
-
-
 def terminal_state(board):
     """ Check who won the game and return the utility """
     if game_completed(board, player_num=1):
@@ -70,15 +18,6 @@ def terminal_state(board):
         return None
 
 
-def available_actions(board):
-    """ Given the current game state returns the valid columns """
-    valid_cols = []
-    for col in range(board.shape[1]):
-        if 0 in board[:, col]:
-            valid_cols.append(col)
-    return valid_cols
-
-
 class AIPlayer:
     def __init__(self, player_number):
         self.player_number = player_number